@@ -0,0 +1,192 @@
+"""
+Admission control for expensive requests.
+
+Range-heavy reads are bounded per route class and per user, so a few callers
+asking for multi-year ranges cannot hold every database connection while login
+and writes wait behind them. A request over its limits waits up to
+ADMISSION_QUEUE_TIMEOUT_MS for a slot; when the class queue is
+ADMISSION_MAX_QUEUE deep, the recent queueing delay is above
+ADMISSION_SHED_WAIT_MS, or the deadline passes, it is answered 503 with
+Retry-After instead. Routes without a class (login, search, the feed, metrics)
+are never held back. Keep the class limits below the database pool size so
+unclassified routes always find a free connection.
+"""
+import asyncio
+import os
+import time
+
+import jwt
+from fastapi.responses import JSONResponse
+
+from metrics import ADMISSION_QUEUE_WAIT, ADMISSION_QUEUED, ADMISSION_REJECTED
+from utils import decode_token
+
+ADMISSION_EXPENSIVE_CONCURRENCY = int(os.getenv("ADMISSION_EXPENSIVE_CONCURRENCY") or "6")
+ADMISSION_EXPORT_CONCURRENCY = int(os.getenv("ADMISSION_EXPORT_CONCURRENCY") or "2")
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY") or "8")
+ADMISSION_USER_CONCURRENCY = int(os.getenv("ADMISSION_USER_CONCURRENCY") or "2")
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE") or "32")
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS") or "2000")
+ADMISSION_SHED_WAIT_MS = float(os.getenv("ADMISSION_SHED_WAIT_MS") or "1000")
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER") or "1")
+
+# (method, path) -> route class
+ROUTE_CLASSES = {
+    ("GET", "/property-sales"): "expensive",
+    ("GET", "/property-sales/aggregates"): "expensive",
+    ("GET", "/property-sales/clusters"): "expensive",
+    ("GET", "/property-sales/nearby"): "expensive",
+    ("GET", "/property-sales/export"): "export",
+    ("GET", "/properties/nearby"): "expensive",
+    ("GET", "/unsold-properties"): "expensive",
+    ("POST", "/property-sales"): "write",
+    ("POST", "/property-sales/bulk"): "write",
+}
+CLASS_CONCURRENCY = {
+    "expensive": ADMISSION_EXPENSIVE_CONCURRENCY,
+    # Exports hold their slot for the whole download, so they get their own
+    "export": ADMISSION_EXPORT_CONCURRENCY,
+    "write": ADMISSION_WRITE_CONCURRENCY,
+}
+# Smoothing of the queue wait average the shedding decision looks at
+WAIT_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class RouteClass:
+    """Concurrency slots, queue depth and smoothed queue wait of one route class."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.slots = asyncio.Semaphore(limit)
+        self.queued = 0
+        self.wait_ms = 0.0
+
+    def record_wait(self, waited_ms: float):
+        self.wait_ms += WAIT_SMOOTHING * (waited_ms - self.wait_ms)
+
+
+class UserSlots:
+    __slots__ = ("slots", "holders")
+
+    def __init__(self):
+        self.slots = asyncio.Semaphore(ADMISSION_USER_CONCURRENCY)
+        self.holders = 0
+
+
+def _user_key(scope) -> str:
+    for name, value in scope.get("headers") or ():
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                try:
+                    return decode_token(token).get("userid") or "anonymous"
+                except jwt.PyJWTError:
+                    break
+    # The endpoint will reject it; it still shares one user's worth of slots
+    return "anonymous"
+
+
+class AdmissionMiddleware:
+    """ASGI middleware enforcing the limits described in this module."""
+
+    def __init__(self, app):
+        self.app = app
+        self.classes = {}
+        self.users = {}
+
+    def _route_class(self, name: str) -> RouteClass:
+        route_class = self.classes.get(name)
+        if route_class is None:
+            route_class = self.classes[name] = RouteClass(name, CLASS_CONCURRENCY[name])
+        return route_class
+
+    async def __call__(self, scope, receive, send):
+        name = ROUTE_CLASSES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        route_class = self._route_class(name)
+        user_key = _user_key(scope) if name != "write" else None
+        try:
+            user = await self._admit(route_class, user_key)
+        except Rejected as e:
+            ADMISSION_REJECTED.inc(route_class=name, reason=e.reason)
+            response = JSONResponse(
+                {"detail": "Server is busy, try again shortly"}, status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.slots.release()
+            if user is not None:
+                self._release_user(user_key, user)
+
+    async def _admit(self, route_class: RouteClass, user_key):
+        """Takes the user's slot (if any) and then a class slot, within one deadline."""
+        if route_class.queued >= ADMISSION_MAX_QUEUE:
+            raise Rejected("queue_full")
+        if route_class.slots.locked() and route_class.wait_ms > ADMISSION_SHED_WAIT_MS:
+            raise Rejected("queue_wait")
+        deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT_MS / 1000
+        started = time.perf_counter()
+        route_class.queued += 1
+        ADMISSION_QUEUED.inc(route_class=route_class.name)
+        user = None
+        holding_user = admitted = False
+        try:
+            if user_key is not None:
+                user = self.users.get(user_key)
+                if user is None:
+                    user = self.users[user_key] = UserSlots()
+                user.holders += 1
+                if not await _acquire(user.slots, deadline):
+                    raise Rejected("user_limit")
+                holding_user = True
+            if not await _acquire(route_class.slots, deadline):
+                raise Rejected("timeout")
+            admitted = True
+        finally:
+            if user is not None and not admitted:
+                # Also reached on cancellation, so a queued request never leaks a slot
+                if holding_user:
+                    user.slots.release()
+                self._forget_user(user_key, user)
+            route_class.queued -= 1
+            ADMISSION_QUEUED.dec(route_class=route_class.name)
+            waited = time.perf_counter() - started
+            route_class.record_wait(waited * 1000)
+            ADMISSION_QUEUE_WAIT.observe(waited, route_class=route_class.name)
+        return user
+
+    def _release_user(self, user_key, user: UserSlots):
+        user.slots.release()
+        self._forget_user(user_key, user)
+
+    def _forget_user(self, user_key, user: UserSlots):
+        # Drop idle users so the map only holds callers with requests in flight
+        user.holders -= 1
+        if user.holders == 0 and self.users.get(user_key) is user:
+            del self.users[user_key]
+
+
+async def _acquire(semaphore: asyncio.Semaphore, deadline: float) -> bool:
+    if not semaphore.locked():
+        await semaphore.acquire()
+        return True
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        return False
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
@@ -1,19 +1,35 @@
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from db import database
-from utils import create_access_token, create_refresh_token
-import bcrypt
+from db import database, read_database
+from passwords import PasswordQueueFull, hash_password, needs_rehash, verify_password
+from utils import create_access_token, create_refresh_token, decode_token
+import jwt
 
 router = APIRouter()
 
+def _token_data(user):
+    return {"sub": user["username"], "role": user["role"], "userid": str(user["userid"])}
+
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     query = "SELECT userid, username, password, role FROM users WHERE username = :username"
-    user = await database.fetch_one(query, {"username": form_data.username})
-    if not user or not bcrypt.checkpw(form_data.password.encode(), user["password"].encode()):
+    user = await read_database.fetch_one(query, {"username": form_data.username})
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+    try:
+        valid = await verify_password(form_data.password, user["password"])
+        if valid and needs_rehash(user["password"]):
+            # Upgrade the stored hash to the configured cost factor while we have the plaintext
+            await database.execute(
+                "UPDATE users SET password = :password WHERE userid = :userid",
+                {"password": await hash_password(form_data.password), "userid": user["userid"]}
+            )
+    except PasswordQueueFull:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many logins in progress, try again shortly", headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
-    token_data = {"sub": user["username"], "role": user["role"]}
+    token_data = _token_data(user)
     access_token = create_access_token(token_data)
     refresh_token = create_refresh_token(token_data)
     return {
@@ -24,3 +40,27 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         "refresh_token": refresh_token,
         "token_type": "bearer"
     }
+
+@router.post("/refresh")
+async def refresh(refresh_token: str = Body(..., embed=True)):
+    """
+    Exchanges a refresh token for a new access/refresh token pair.
+    The user is re-read so role changes and deletions take effect.
+    """
+    try:
+        payload = decode_token(refresh_token, token_type="refresh")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    query = "SELECT userid, username, role FROM users WHERE username = :username"
+    user = await read_database.fetch_one(query, {"username": payload.get("sub")})
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    token_data = _token_data(user)
+    return {
+        "userid": user["userid"],
+        "username": user["username"],
+        "role": user["role"],
+        "access_token": create_access_token(token_data),
+        "refresh_token": create_refresh_token(token_data),
+        "token_type": "bearer"
+    }
@@ -0,0 +1,106 @@
+import re
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from db import reader
+from geo import MAX_RADIUS_KM, distance_sql, nearby
+from .property_sales import get_current_user
+
+router = APIRouter()
+
+
+@router.get("/properties/nearby", tags=["properties"])
+async def get_nearby_properties(
+    current_user: dict = Depends(get_current_user),
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the search centre"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the search centre"),
+    radius_km: float = Query(None, gt=0, le=MAX_RADIUS_KM, description="Only properties within this distance; omit for the nearest ones"),
+    limit: int = Query(10, ge=1, le=500, description="Maximum number of properties"),
+    sold: bool = Query(None, description="Only sold (true) or unsold (false) properties")
+):
+    """
+    Returns properties ordered by distance from (lat, lon), with distance_km.
+    """
+    filters = []
+    params = {}
+    if sold is not None:
+        filters.append("p.sold = :sold")
+        params["sold"] = sold
+    select_sql = f"""
+        SELECT p.id AS property_id, p.address1, p.address2, p.city, p.postcode,
+               p.latitude, p.longitude, p.sold, {distance_sql()} AS distance_km
+        FROM properties p
+    """
+    rows = await nearby(reader(current_user.get("userid")), select_sql, filters, params, lat, lon, radius_km, limit)
+    return [
+        {
+            "property_id": row["property_id"],
+            "address1": row["address1"],
+            "address2": row["address2"],
+            "city": row["city"],
+            "postcode": row["postcode"],
+            "latitude": row["latitude"],
+            "longitude": row["longitude"],
+            "sold": row["sold"],
+            "distance_km": row["distance_km"]
+        }
+        for row in rows
+    ]
+
+
+SEARCH_MAX_TERMS = 8
+# Shorter prefixes match too much of the index to rank in time
+SEARCH_MIN_PREFIX_LENGTH = 2
+
+
+def _prefix_tsquery(q: str):
+    """
+    Every word must match, as a prefix if it is at least SEARCH_MIN_PREFIX_LENGTH
+    long and as a whole word otherwise, e.g. "5 high st" -> 5 & high:* & st:*.
+    Empty unless at least one word is long enough to match as a prefix.
+    """
+    terms = re.findall(r"[^\W_]+", q.lower())[:SEARCH_MAX_TERMS]
+    if all(len(term) < SEARCH_MIN_PREFIX_LENGTH for term in terms):
+        return ""
+    return " & ".join(term if len(term) < SEARCH_MIN_PREFIX_LENGTH else f"{term}:*" for term in terms)
+
+
+@router.get("/properties/search", tags=["properties"])
+async def search_properties(
+    current_user: dict = Depends(get_current_user),
+    q: str = Query(..., min_length=SEARCH_MIN_PREFIX_LENGTH, max_length=200, description="Words or prefixes of the address, postcode or city"),
+    sold: bool = Query(None, description="Only sold (true) or unsold (false) properties"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of properties")
+):
+    """
+    Type-ahead search over address1, address2, postcode and city, served from the
+    GIN index on properties.search_vector. Results are ranked with address and
+    postcode matches above city matches.
+    """
+    tsquery = _prefix_tsquery(q)
+    if not tsquery:
+        raise HTTPException(status_code=400, detail=f"Search query needs a word of at least {SEARCH_MIN_PREFIX_LENGTH} characters.")
+    filters = ["p.search_vector @@ to_tsquery('simple', :tsquery)"]
+    params = {"tsquery": tsquery, "limit": limit}
+    if sold is not None:
+        filters.append("p.sold = :sold")
+        params["sold"] = sold
+    query = """
+        SELECT p.id AS property_id, p.address1, p.address2, p.city, p.postcode, p.sold,
+               ts_rank(p.search_vector, to_tsquery('simple', :tsquery)) AS rank
+        FROM properties p
+        WHERE """ + " AND ".join(filters) + """
+        ORDER BY rank DESC, p.address1, p.id
+        LIMIT :limit
+    """
+    rows = await reader(current_user.get("userid")).fetch_all(query, params)
+    return [
+        {
+            "property_id": row["property_id"],
+            "address1": row["address1"],
+            "address2": row["address2"],
+            "city": row["city"],
+            "postcode": row["postcode"],
+            "sold": row["sold"]
+        }
+        for row in rows
+    ]
@@ -2,140 +2,658 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from .auth import router as auth_router
-from db import database
+from db import READ_YOUR_WRITES_SECONDS, database, note_write, read_database, reader
 from fastapi import APIRouter
+from cache import cache_key, cached_response, generation, in_flight, invalidate, make_etag, response_cache, settled, user_scope
+from geo import MAX_RADIUS_KM, distance_sql, nearby
+from sketches import PRICE_HISTOGRAM_BUCKETS, PRICE_HISTOGRAM_WIDTH, histogram_buckets, price_distributions
+from feed import RESYNC, notify_sql, sales_feed
+from export import CSV_MEDIA_TYPE, GZIP_MEDIA_TYPE, PARQUET_MEDIA_TYPE, parquet_schema, stream_csv, stream_parquet
+from formats import ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, arrow_body, columnar_body, dumps, negotiate_format, to_columns
+from utils import decode_token
 import jwt
-import os
-import logging
-logger = logging.getLogger("property_sales_debug")
-if not logger.hasHandlers():
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter("%(levelname)s:%(name)s:%(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-logger.setLevel(logging.WARNING)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
-    SECRET_KEY = os.getenv("JWT_SECRET_KEY")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload
+        return decode_token(token)
     except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
 
-from fastapi import Query
+from fastapi import Query, Request
+from fastapi.responses import StreamingResponse
+from datetime import date, timedelta
+import asyncio
+import base64
+import os
 
 router = APIRouter()
 
-@router.get("/property-sales", tags=["property_sales"])
-async def get_property_sales(
-    current_user: dict = Depends(get_current_user),
-    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
-    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)")
-):
-    import sys
-    print("[PRINT] Entered get_property_sales endpoint", file=sys.stderr)
+
+def _date_filters(start_date, end_date):
+    """
+    Builds the sold_date filters and bind params shared by the sales endpoints.
+    """
     from datetime import datetime
     filters = []
     params = {}
     if start_date:
         try:
-            start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-            filters.append("CAST(ps.sold_date AS DATE) >= :start_date")
-            params["start_date"] = start_date_obj
+            params["start_date"] = datetime.strptime(start_date, "%Y-%m-%d").date()
+            filters.append("ps.sold_date >= :start_date")
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid start_date format. Use YYYY-MM-DD.")
     if end_date:
         try:
-            end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
-            filters.append("CAST(ps.sold_date AS DATE) <= :end_date")
-            params["end_date"] = end_date_obj
+            params["end_date"] = datetime.strptime(end_date, "%Y-%m-%d").date()
+            filters.append("ps.sold_date <= :end_date")
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid end_date format. Use YYYY-MM-DD.")
+    return filters, params
+
+
+def _current_userid(current_user: dict):
+    # Tokens carry the userid claim, so scoping needs no users lookup
+    userid = current_user.get("userid")
+    if not userid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    return UUID(userid)
+
+
+def _reader(current_user: dict):
+    # Replica for reads, primary for a user who has just registered a sale
+    return reader(current_user.get("userid"))
+
+
+def _cacheable(namespace: str, started_generation: int, db) -> bool:
+    """
+    Whether a result read from db may be cached: no write landed during the
+    query and, for replica reads, none in the last READ_YOUR_WRITES_SECONDS,
+    which the replica may not have replayed yet.
+    """
+    if generation(namespace) != started_generation:
+        return False
+    return db is database or settled(namespace, READ_YOUR_WRITES_SECONDS)
+
+
+def _scoped_filters(current_user: dict, start_date, end_date):
+    """
+    Date filters plus the role scoping: admins see every sale, users only their own.
+    """
+    filters, params = _date_filters(start_date, end_date)
+    if current_user.get("role") != "admin":
+        filters.append("ps.userid = :userid")
+        params["userid"] = _current_userid(current_user)
+    return filters, params
+
+
+# group_by dimension -> (SQL expression, response key)
+AGGREGATE_DIMENSIONS = {
+    "city": ("p.city", "city"),
+    "user": ("u.username", "username"),
+    "month": ("CAST(date_trunc('month', ps.sold_date) AS DATE)", "month"),
+    "week": ("CAST(date_trunc('week', ps.sold_date) AS DATE)", "week"),
+}
+
+# Kept apart so endpoints can select extra columns alongside the sale fields
+SALES_SELECT = """
+    ps.id AS sale_id, p.id as property_id, ps.userid, p.latitude, p.longitude, p.city, p.address1,
+    CAST(ps.sold_for AS DOUBLE PRECISION) AS sold_for, ps.sold_date, u.username
+"""
+SALES_FROM = """
+    FROM property_sales ps
+    JOIN properties p ON ps.property_id = p.id
+    JOIN users u ON ps.userid = u.userid
+"""
+SALES_QUERY = f"SELECT {SALES_SELECT}{SALES_FROM}"
+SALE_COLUMNS = ["property_id", "userid", "username", "address1", "latitude", "longitude", "city", "sold_for", "sold_date"]
+MAX_PAGE_SIZE = 10000
+NDJSON_BATCH_ROWS = 500
+
+
+def _sale_to_dict(row):
+    return {
+        "property_id": row["property_id"],
+        "userid": row["userid"],
+        "username": row["username"],
+        "address1": row["address1"],
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "city": row["city"],
+        "sold_for": float(row["sold_for"]),
+        "sold_date": row["sold_date"].isoformat() if row["sold_date"] else None
+    }
+
+
+def _encode_cursor(row):
+    raw = f"{row['sold_date'].isoformat()}|{row['sale_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sold_date, sale_id = raw.split("|")
+        return date.fromisoformat(sold_date), int(sale_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+async def _stream_ndjson(db, query: str, params: dict):
+    # Rows come off a server-side cursor, so memory stays flat however big the range is.
+    batch = []
+    async for row in db.iterate(query, params):
+        batch.append(dumps(_sale_to_dict(row)))
+        if len(batch) >= NDJSON_BATCH_ROWS:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+@router.get("/property-sales", tags=["property_sales"])
+async def get_property_sales(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)"),
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; enables keyset pagination ordered by sold_date, id"),
+    cursor: str = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    stream: bool = Query(False, description="Stream rows as newline-delimited JSON"),
+    format: str = Query(None, description="json (default), columnar or arrow; also negotiated via Accept")
+):
+    """
+    Returns sales in the date range. With `limit`, rows are ordered by (sold_date, id)
+    and the cursor for the next page is returned in the X-Next-Cursor header.
+    With `stream=true` (or `Accept: application/x-ndjson`) rows are written as NDJSON
+    while they are read from the database (not combinable with pagination).
+    `format=columnar` returns one array per field instead of one object per sale,
+    and `format=arrow` an Arrow IPC stream.
+    """
+    filters, params = _scoped_filters(current_user, start_date, end_date)
+    if cursor:
+        params["cursor_date"], params["cursor_id"] = _decode_cursor(cursor)
+        filters.append("(ps.sold_date, ps.id) > (:cursor_date, :cursor_id)")
+    query = SALES_QUERY
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = limit or MAX_PAGE_SIZE
+        query += " ORDER BY ps.sold_date, ps.id LIMIT :limit"
+        params["limit"] = limit + 1
+    db = _reader(current_user)
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        # The cursor header would have to be sent before the rows are known
+        if paginated:
+            raise HTTPException(status_code=400, detail="Streaming cannot be combined with limit or cursor.")
+        return StreamingResponse(_stream_ndjson(db, query, params), media_type="application/x-ndjson")
+    fmt = negotiate_format(request, format)
+    key = cache_key("sales", user_scope(current_user), params.get("start_date"), params.get("end_date"), limit, cursor, fmt)
+    # Entries may have been filled from a lagging replica, so recent writers skip them
+    entry = response_cache.get(key) if db is read_database else None
+    if entry is None:
+        async def build():
+            started_generation = generation("sales")
+            rows = await db.fetch_all(query, params)
+            headers = {}
+            if paginated and len(rows) > limit:
+                rows = rows[:limit]
+                headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+            if fmt == "json":
+                body, media_type = dumps([_sale_to_dict(row) for row in rows]), "application/json"
+            else:
+                # Columns come straight off the records; the encoder handles dates and UUIDs
+                columns = to_columns(rows, SALE_COLUMNS)
+                if fmt == "arrow":
+                    body, media_type = arrow_body(columns), ARROW_MEDIA_TYPE
+                else:
+                    body, media_type = columnar_body(columns, len(rows)), COLUMNAR_MEDIA_TYPE
+            entry = (body, make_etag(body), media_type, headers)
+            if _cacheable("sales", started_generation, db):
+                response_cache.set(key, entry)
+            return entry
+
+        # Identical requests arriving while this one queries share its result;
+        # the generation keeps requests made after a write off an older flight
+        entry = await in_flight.do(f"{key}@{db.name}#{generation('sales')}", build)
+    body, etag, media_type, headers = entry
+    return cached_response(request, body, etag, media_type=media_type, headers=headers)
+
+
+@router.get("/property-sales/aggregates", tags=["property_sales"])
+async def get_property_sales_aggregates(
+    current_user: dict = Depends(get_current_user),
+    group_by: str = Query("city", description="Comma-separated dimensions: city, user, month, week"),
+    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)")
+):
+    """
+    Returns count, sum, avg, min and max of sold_for per group, computed in SQL
+    with the same date filters and role scoping as GET /property-sales.
+    """
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    if not dimensions or any(d not in AGGREGATE_DIMENSIONS for d in dimensions):
+        raise HTTPException(status_code=400, detail=f"Invalid group_by. Use any of: {', '.join(AGGREGATE_DIMENSIONS)}.")
+    dimensions = list(dict.fromkeys(dimensions))
+    filters, params = _scoped_filters(current_user, start_date, end_date)
+    columns = [f"{AGGREGATE_DIMENSIONS[d][0]} AS {AGGREGATE_DIMENSIONS[d][1]}" for d in dimensions]
+    positions = ", ".join(str(i + 1) for i in range(len(dimensions)))
+    query = f"""
+        SELECT {", ".join(columns)},
+               COUNT(*) AS count, SUM(ps.sold_for) AS sum, AVG(ps.sold_for) AS avg,
+               MIN(ps.sold_for) AS min, MAX(ps.sold_for) AS max
+        FROM property_sales ps
+        JOIN properties p ON ps.property_id = p.id
+        JOIN users u ON ps.userid = u.userid
+    """
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += f" GROUP BY {positions} ORDER BY {positions}"
+    rows = await _reader(current_user).fetch_all(query, params)
+    keys = [AGGREGATE_DIMENSIONS[d][1] for d in dimensions]
+    results = []
+    for row in rows:
+        item = {key: row[key].isoformat() if d in ("month", "week") else row[key] for d, key in zip(dimensions, keys)}
+        item.update({
+            "count": row["count"],
+            "sum": float(row["sum"]),
+            "avg": float(row["avg"]),
+            "min": float(row["min"]),
+            "max": float(row["max"])
+        })
+        results.append(item)
+    return results
+
+
+@router.get("/property-sales/distribution", tags=["property_sales"])
+async def get_property_sales_distribution(
+    current_user: dict = Depends(get_current_user),
+    group_by: str = Query("city", description="Comma-separated dimensions: city, month; empty for one overall group"),
+    quantiles: str = Query("0.5,0.9", description="Comma-separated quantiles between 0 and 1"),
+    city: str = Query(None, description="Comma-separated cities to include"),
+    start_date: str = Query(None, description="Include sales from this date's month (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Include sales up to this date's month (YYYY-MM-DD)")
+):
+    """
+    Returns sold_for quantiles and a fixed-bucket histogram per group. Admins are
+    served from incrementally maintained sketches (quantiles within about 1%
+    relative error) rather than from the sales rows; a user's own sales are
+    summarised exactly in SQL. Periods have month granularity.
+    """
+    dimensions = list(dict.fromkeys(d.strip() for d in group_by.split(",") if d.strip()))
+    if any(d not in ("city", "month") for d in dimensions):
+        raise HTTPException(status_code=400, detail="Invalid group_by. Use any of: city, month.")
+    try:
+        qs = [float(q) for q in quantiles.split(",") if q.strip()]
+    except ValueError:
+        qs = None
+    if not qs or any(not 0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="Invalid quantiles. Use comma-separated values between 0 and 1.")
+    _, params = _date_filters(start_date, end_date)
+    start_month = params["start_date"].replace(day=1) if "start_date" in params else None
+    end_month = params["end_date"].replace(day=1) if "end_date" in params else None
+    cities = {c.strip() for c in city.split(",") if c.strip()} if city else None
     if current_user.get("role") == "admin":
-        query = """
-            SELECT p.id as property_id, ps.userid, p.latitude, p.longitude, p.city, p.address1, ps.sold_for, ps.sold_date, u.username
-            FROM property_sales ps
-            JOIN properties p ON ps.property_id = p.id
-            JOIN users u ON ps.userid = u.userid
-        """
-        if filters:
-            query += " WHERE " + " AND ".join(filters)
-        print("[PRINT] About to log SQL query", file=sys.stderr)
-        logger.warning(f"[DEBUG] SQL: {query}")
-        logger.warning(f"[DEBUG] Params: {params}")
-        print("[PRINT] About to fetch rows", file=sys.stderr)
-        rows = await database.fetch_all(query, params)
-        print(f"[PRINT] Rows fetched: {len(rows)}", file=sys.stderr)
-        logger.warning(f"[DEBUG] Results: {len(rows)}")
-    else:
-        username = current_user.get("sub")
-        user_row = await database.fetch_one("SELECT userid FROM users WHERE username = :username", {"username": username})
-        if not user_row:
-            raise HTTPException(status_code=404, detail="User not found")
-        userid = user_row["userid"]
-        query = """
-            SELECT p.id as property_id, ps.userid, p.latitude, p.longitude, p.city, p.address1, ps.sold_for, ps.sold_date, u.username
-            FROM property_sales ps
-            JOIN properties p ON ps.property_id = p.id
-            JOIN users u ON ps.userid = u.userid
-            WHERE ps.userid = :userid
-        """
-        if filters:
-            query += " AND " + " AND ".join(filters)
-        params["userid"] = userid
-        print("[PRINT] About to log SQL query (user)", file=sys.stderr)
-        logger.warning(f"[DEBUG] SQL: {query}")
-        logger.warning(f"[DEBUG] Params: {params}")
-        print("[PRINT] About to fetch rows (user)", file=sys.stderr)
-        rows = await database.fetch_all(query, params)
-        print(f"[PRINT] Rows fetched (user): {len(rows)}", file=sys.stderr)
-        logger.warning(f"[DEBUG] Results: {len(rows)}")
-    return [
-        {
-            "property_id": row["property_id"],
-            "userid": row["userid"],
-            "username": row["username"],
-            "address1": row["address1"],
-            "latitude": row["latitude"],
-            "longitude": row["longitude"],
-            "city": row["city"],
-            "sold_for": float(row["sold_for"]),
-            "sold_date": row["sold_date"].isoformat() if row["sold_date"] else None
+        await price_distributions.ready(database)
+        merged = price_distributions.query(cities, start_month, end_month, tuple(dimensions))
+        groups = {
+            key: (
+                stats.count,
+                stats.total / stats.count if stats.count else None,
+                stats.min if stats.count else None,
+                stats.max if stats.count else None,
+                [stats.quantile(q) for q in qs],
+                stats.histogram
+            )
+            for key, stats in merged.items()
         }
-        for row in rows
-    ]
+    else:
+        groups = await _user_price_groups(
+            _reader(current_user), _current_userid(current_user), dimensions, qs, cities, start_month, end_month
+        )
+    results = []
+    for key in sorted(groups):
+        count, avg, low, high, values, histogram = groups[key]
+        item = {d: v.isoformat() if d == "month" else v for d, v in zip(dimensions, key)}
+        item.update({
+            "count": count,
+            "avg": avg,
+            "min": low,
+            "max": high,
+            "quantiles": {f"{q:g}": v for q, v in zip(qs, values)},
+            "histogram": histogram_buckets(histogram)
+        })
+        results.append(item)
+    return results
 
 
-@router.get("/unsold-properties", tags=["properties"])
-async def get_unsold_properties(current_user: dict = Depends(get_current_user)):
+async def _user_price_groups(db, userid, dimensions, qs, cities, start_month, end_month):
+    """
+    Exact count/avg/min/max, quantiles and sparse histogram per group of one
+    user's sales, keyed like PriceDistributions.query. The rows come off
+    idx_property_sales_userid_sold_date, so this stays cheap per user.
     """
-    Returns property_id, address1, address2, and city for all unsold properties.
+    filters = ["ps.userid = :userid", "ps.sold_for > 0"]
+    params = {"userid": userid}
+    if cities:
+        filters.append("p.city = ANY(:cities)")
+        params["cities"] = sorted(cities)
+    if start_month:
+        filters.append("ps.sold_date >= :start_month")
+        params["start_month"] = start_month
+    if end_month:
+        filters.append("ps.sold_date < :after_end_month")
+        params["after_end_month"] = (end_month + timedelta(days=31)).replace(day=1)
+    columns = "".join(f"{AGGREGATE_DIMENSIONS[d][0]} AS {d}, " for d in dimensions)
+    source = f"""
+        FROM property_sales ps
+        JOIN properties p ON ps.property_id = p.id
+        WHERE {" AND ".join(filters)}
     """
+    group_by = f" GROUP BY {', '.join(str(i + 1) for i in range(len(dimensions)))}" if dimensions else ""
+    price = "CAST(ps.sold_for AS DOUBLE PRECISION)"
+    stats_rows = await db.fetch_all(f"""
+        SELECT {columns}COUNT(*) AS count, AVG({price}) AS avg, MIN({price}) AS min, MAX({price}) AS max,
+               percentile_cont(CAST(:quantiles AS DOUBLE PRECISION[])) WITHIN GROUP (ORDER BY {price}) AS quantiles
+        {source}{group_by}
+    """, {**params, "quantiles": qs})
+    # width_bucket numbers the buckets below the top 1..n and everything above n + 1
+    histogram_rows = await db.fetch_all(f"""
+        SELECT {columns}width_bucket({price}, 0, CAST(:histogram_top AS DOUBLE PRECISION), CAST(:open_bucket AS INTEGER)) - 1 AS bucket,
+               COUNT(*) AS n
+        {source}
+        GROUP BY {', '.join(str(i + 1) for i in range(len(dimensions) + 1))}
+    """, {
+        **params,
+        "histogram_top": PRICE_HISTOGRAM_WIDTH * (PRICE_HISTOGRAM_BUCKETS - 1),
+        "open_bucket": PRICE_HISTOGRAM_BUCKETS - 1,
+    })
+    histograms = {}
+    for row in histogram_rows:
+        histograms.setdefault(tuple(row[d] for d in dimensions), {})[row["bucket"]] = row["n"]
+    groups = {}
+    for row in stats_rows:
+        if not row["count"]:
+            # Without group_by an empty range still yields one row
+            continue
+        key = tuple(row[d] for d in dimensions)
+        groups[key] = (row["count"], row["avg"], row["min"], row["max"], list(row["quantiles"]), histograms.get(key, {}))
+    return groups
+
+
+# Export columns as (name, Arrow type alias) for the Parquet schema
+EXPORT_FIELDS = [
+    ("sale_id", "int64"), ("property_id", "string"), ("userid", "string"), ("username", "string"),
+    ("address1", "string"), ("city", "string"), ("latitude", "double"), ("longitude", "double"),
+    ("sold_for", "double"), ("sold_date", "date32"),
+]
+
+
+@router.get("/property-sales/export", tags=["property_sales"])
+async def export_property_sales(
+    current_user: dict = Depends(get_current_user),
+    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)"),
+    format: str = Query("csv", description="csv or parquet"),
+    gzip: bool = Query(False, description="Gzip the CSV")
+):
+    """
+    Downloads every sale in the date range, ordered by (sold_date, id), with the
+    same role scoping as GET /property-sales. CSV is streamed from Postgres COPY;
+    Parquet is written one row group at a time. Memory use does not grow with
+    the number of rows.
+    """
+    if format not in ("csv", "parquet"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use one of: csv, parquet.")
+    filters, params = _scoped_filters(current_user, start_date, end_date)
+    query = f"""
+        SELECT {", ".join(name for name, _ in EXPORT_FIELDS)}
+        FROM ({SALES_QUERY}{" WHERE " + " AND ".join(filters) if filters else ""}) AS sales
+        ORDER BY sold_date, sale_id
+    """
+    db = _reader(current_user)
+    if format == "parquet":
+        body = stream_parquet(db, query, params, parquet_schema(EXPORT_FIELDS))
+        media_type, filename = PARQUET_MEDIA_TYPE, "property-sales.parquet"
+    else:
+        body = stream_csv(db, query, params, compress=gzip)
+        media_type, filename = (GZIP_MEDIA_TYPE, "property-sales.csv.gz") if gzip else (CSV_MEDIA_TYPE, "property-sales.csv")
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+FEED_KEEPALIVE_SECONDS = float(os.getenv("FEED_KEEPALIVE_SECONDS") or "15")
+
+
+def get_stream_user(
+    token: str = Depends(optional_oauth2_scheme),
+    access_token: str = Query(None, description="Access token, for clients such as EventSource that cannot set headers")
+):
+    return get_current_user(token or access_token or "")
+
+
+def _sse(event: str, data, event_id=None) -> bytes:
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+@router.get("/property-sales/stream", tags=["property_sales"])
+async def stream_property_sales(
+    request: Request,
+    current_user: dict = Depends(get_stream_user),
+    start_date: str = Query(None, description="Only sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Only sales up to this date (YYYY-MM-DD)")
+):
+    """
+    Server-sent events pushing each sale as it commits, with the same role scoping
+    as GET /property-sales. A client that falls too far behind receives a `resync`
+    event and is disconnected; it should reload its range and reconnect.
+    """
+    _, params = _date_filters(start_date, end_date)
+    userid = None if current_user.get("role") == "admin" else str(_current_userid(current_user))
+    start = params["start_date"].isoformat() if "start_date" in params else None
+    end = params["end_date"].isoformat() if "end_date" in params else None
+
+    def accept(sale):
+        # ISO dates compare correctly as strings
+        return ((userid is None or sale["userid"] == userid)
+                and (start is None or sale["sold_date"] >= start)
+                and (end is None or sale["sold_date"] <= end))
+
+    subscription = sales_feed.subscribe(accept)
+
+    async def events():
+        try:
+            yield b"retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    sales = await asyncio.wait_for(subscription.queue.get(), FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if sales is RESYNC:
+                    yield _sse("resync", {})
+                    break
+                yield b"".join(_sse("sale", sale, sale["sale_id"]) for sale in sales)
+        finally:
+            sales_feed.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/property-sales/nearby", tags=["property_sales"])
+async def get_nearby_property_sales(
+    current_user: dict = Depends(get_current_user),
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the search centre"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the search centre"),
+    radius_km: float = Query(None, gt=0, le=MAX_RADIUS_KM, description="Only sales within this distance; omit for the nearest ones"),
+    limit: int = Query(10, ge=1, le=500, description="Maximum number of sales"),
+    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)"),
+    min_price: float = Query(None, ge=0, description="Minimum sold_for"),
+    max_price: float = Query(None, ge=0, description="Maximum sold_for")
+):
+    """
+    Returns sales ordered by distance from (lat, lon), with distance_km, using the
+    same date filters and role scoping as GET /property-sales.
+    """
+    filters, params = _scoped_filters(current_user, start_date, end_date)
+    if min_price is not None:
+        filters.append("ps.sold_for >= :min_price")
+        params["min_price"] = Decimal(str(min_price))
+    if max_price is not None:
+        filters.append("ps.sold_for <= :max_price")
+        params["max_price"] = Decimal(str(max_price))
+    select_sql = f"SELECT {distance_sql()} AS distance_km, {SALES_SELECT}{SALES_FROM}"
+    rows = await nearby(_reader(current_user), select_sql, filters, params, lat, lon, radius_km, limit)
+    return [dict(_sale_to_dict(row), distance_km=row["distance_km"]) for row in rows]
+
+
+# Grid cells per 256px map tile, and the zoom from which individual pins are returned.
+CLUSTER_CELLS_PER_TILE = 4
+CLUSTER_PIN_ZOOM = 15
+CLUSTER_MAX_PINS = 5000
+
+
+def _parse_bbox(bbox: str):
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid bbox. Use min_lon,min_lat,max_lon,max_lat.")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="Invalid bbox. Min values must not exceed max values.")
+    return {"min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat}
+
+
+@router.get("/property-sales/clusters", tags=["property_sales"])
+async def get_property_sales_clusters(
+    current_user: dict = Depends(get_current_user),
+    bbox: str = Query(..., description="Visible viewport as min_lon,min_lat,max_lon,max_lat"),
+    zoom: int = Query(..., ge=0, le=22, description="Map zoom level"),
+    start_date: str = Query(None, description="Filter sales from this date (YYYY-MM-DD)"),
+    end_date: str = Query(None, description="Filter sales up to this date (YYYY-MM-DD)")
+):
+    """
+    Returns sales inside the viewport bucketed on a lat/lon grid sized for the zoom
+    level, with count and price sum per bucket. From CLUSTER_PIN_ZOOM upwards the
+    individual sales are returned instead.
+    """
+    filters, params = _scoped_filters(current_user, start_date, end_date)
+    params.update(_parse_bbox(bbox))
+    filters.append("p.latitude BETWEEN :min_lat AND :max_lat")
+    filters.append("p.longitude BETWEEN :min_lon AND :max_lon")
+    where = " WHERE " + " AND ".join(filters)
+    if zoom >= CLUSTER_PIN_ZOOM:
+        params["limit"] = CLUSTER_MAX_PINS
+        rows = await _reader(current_user).fetch_all(SALES_QUERY + where + " LIMIT :limit", params)
+        return {"zoom": zoom, "clusters": [], "points": [_sale_to_dict(row) for row in rows]}
+    params["cell"] = 360.0 / (2 ** zoom * CLUSTER_CELLS_PER_TILE)
     query = """
-        SELECT p.id as property_id, p.address1, p.address2, p.city
-        FROM properties p
-        LEFT JOIN property_sales ps ON p.id = ps.property_id
-        WHERE ps.property_id IS NULL
+        SELECT COUNT(*) AS count, SUM(ps.sold_for) AS sum,
+               AVG(p.latitude) AS latitude, AVG(p.longitude) AS longitude
+        FROM property_sales ps
+        JOIN properties p ON ps.property_id = p.id
+    """ + where + """
+        GROUP BY FLOOR(p.longitude / :cell), FLOOR(p.latitude / :cell)
     """
-    rows = await database.fetch_all(query)
-    return [
-        {
-            "property_id": row["property_id"],
-            "address1": row["address1"],
-            "address2": row["address2"],
-            "city": row["city"]
-        }
-        for row in rows
-    ]
+    rows = await _reader(current_user).fetch_all(query, params)
+    return {
+        "zoom": zoom,
+        "cell_size": params["cell"],
+        "clusters": [
+            {
+                "latitude": row["latitude"],
+                "longitude": row["longitude"],
+                "count": row["count"],
+                "sum": float(row["sum"])
+            }
+            for row in rows
+        ],
+        "points": []
+    }
+
+
+def _postcode_range(prefix: str):
+    # Prefix match as a sargable range: [PREFIX, PREFIX with its last character incremented)
+    prefix = prefix.strip().upper()
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@router.get("/unsold-properties", tags=["properties"])
+async def get_unsold_properties(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    city: str = Query(None, description="Only properties in this city"),
+    postcode: str = Query(None, description="Only properties whose postcode starts with this prefix"),
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; enables keyset pagination ordered by property id"),
+    cursor: str = Query(None, description="Value of X-Next-Cursor from the previous page")
+):
+    """
+    Returns property_id, address1, address2, and city for unsold properties.
+    Reads only the partial indexes on properties WHERE NOT sold.
+    """
+    db = _reader(current_user)
+    key = cache_key("unsold", city, postcode, limit, cursor)
+    entry = response_cache.get(key) if db is read_database else None
+    if entry is None:
+        async def build():
+            started_generation = generation("unsold")
+            filters = ["NOT p.sold"]
+            params = {}
+            if city:
+                filters.append("p.city = :city")
+                params["city"] = city
+            if postcode and postcode.strip():
+                filters.append("""upper(p.postcode) COLLATE "C" >= :postcode_from AND upper(p.postcode) COLLATE "C" < :postcode_to""")
+                params["postcode_from"], params["postcode_to"] = _postcode_range(postcode)
+            if cursor:
+                try:
+                    params["cursor_id"] = UUID(cursor)
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="Invalid cursor.")
+                filters.append("p.id > :cursor_id")
+            query = """
+                SELECT p.id as property_id, p.address1, p.address2, p.city
+                FROM properties p
+                WHERE """ + " AND ".join(filters)
+            paginated = limit is not None or cursor is not None
+            if paginated:
+                page_size = limit or MAX_PAGE_SIZE
+                query += " ORDER BY p.id LIMIT :limit"
+                params["limit"] = page_size + 1
+            rows = await db.fetch_all(query, params)
+            headers = {}
+            if paginated and len(rows) > page_size:
+                rows = rows[:page_size]
+                headers["X-Next-Cursor"] = str(rows[-1]["property_id"])
+            body = dumps([
+                {
+                    "property_id": row["property_id"],
+                    "address1": row["address1"],
+                    "address2": row["address2"],
+                    "city": row["city"]
+                }
+                for row in rows
+            ])
+            entry = (body, make_etag(body), headers)
+            if _cacheable("unsold", started_generation, db):
+                response_cache.set(key, entry)
+            return entry
+
+        entry = await in_flight.do(f"{key}@{db.name}#{generation('unsold')}", build)
+    body, etag, headers = entry
+    return cached_response(request, body, etag, headers=headers)
 
 
 from fastapi import Body
 
 from pydantic import BaseModel
-from datetime import date
+from decimal import Decimal
+from typing import List
 from uuid import UUID
 
 class PropertySaleIn(BaseModel):
@@ -144,33 +662,185 @@ class PropertySaleIn(BaseModel):
     sold_date: date
     sold_for: float
 
+BULK_MAX_SALES = 10000
+
+
+def _on_sales_registered(sales, current_user: dict):
+    """
+    Keeps derived state in step with newly committed sales: pins the writers'
+    reads to the primary, drops cached responses and feeds the price
+    distribution sketches. While the sales feed is listening the sketches are
+    fed from its notifications instead, which reach every worker, so a sale is
+    not counted twice here.
+    """
+    note_write(current_user.get("userid"))
+    for userid in {sale["userid"] for sale in sales}:
+        note_write(userid)
+    invalidate("sales")
+    invalidate("unsold")
+    if sales_feed.connected:
+        return
+    for sale in sales:
+        price_distributions.add(sale["sale_id"], sale["city"], sale["sold_date"].replace(day=1), sale["sold_for"])
+
+
+def _on_sales_notified(sales: list):
+    # Runs in every worker, including those that did not register the sales,
+    # once per batch so a bulk upload invalidates the cache once
+    for userid in {sale["userid"] for sale in sales}:
+        note_write(userid)
+    invalidate("sales")
+    invalidate("unsold")
+    for sale in sales:
+        month = date.fromisoformat(sale["sold_date"]).replace(day=1)
+        price_distributions.add(sale["sale_id"], sale["city"], month, sale["sold_for"])
+
+
+def _on_feed_resync():
+    # Sales committed while the listener was down never reached this worker
+    invalidate("sales")
+    invalidate("unsold")
+    price_distributions.start_loading(database)
+
+
+sales_feed.add_handler(_on_sales_notified, resync=_on_feed_resync)
+
+
 @router.post("/property-sales", tags=["property_sales"])
 async def register_property_sale(
     sale: PropertySaleIn,
     current_user: dict = Depends(get_current_user)
 ):
-    # Check if property is unsold
-    check_query = """
-        SELECT p.id FROM properties p
-        LEFT JOIN property_sales ps ON p.id = ps.property_id
-        WHERE p.id = :property_id AND ps.property_id IS NULL
-    """
-    property_row = await database.fetch_one(check_query, {"property_id": sale.property_id})
-    if not property_row:
-        raise HTTPException(status_code=400, detail="Property is already sold or does not exist.")
-    # Insert sale record
+    # Flipping the sold flag row-locks the property, so the unsold check and
+    # the insert are one atomic statement even under concurrent submissions
     insert_query = """
-        INSERT INTO property_sales (property_id, userid, sold_date, sold_for)
-        VALUES (:property_id, :userid, :sold_date, :sold_for)
+        WITH claimed AS (
+            UPDATE properties SET sold = TRUE
+            WHERE id = :property_id AND NOT sold
+            RETURNING id, city, address1, latitude, longitude
+        ),
+        inserted AS (
+            INSERT INTO property_sales (property_id, userid, sold_date, sold_for)
+            SELECT id, :userid, :sold_date, :sold_for
+            FROM claimed
+            RETURNING id, property_id, userid, sold_date, sold_for
+        )
+        SELECT ins.id AS sale_id, c.city, """ + notify_sql("ins", "c", "u") + """
+        FROM inserted ins
+        JOIN claimed c ON c.id = ins.property_id
+        JOIN users u ON u.userid = ins.userid
     """
-    await database.execute(insert_query, {
+    row = await database.fetch_one(insert_query, {
         "property_id": sale.property_id,
         "userid": sale.userid,
         "sold_date": sale.sold_date,
         "sold_for": sale.sold_for
     })
+    if row is None:
+        raise HTTPException(status_code=400, detail="Property is already sold or does not exist.")
+    _on_sales_registered([{
+        "sale_id": row["sale_id"],
+        "userid": sale.userid,
+        "city": row["city"],
+        "sold_date": sale.sold_date,
+        "sold_for": sale.sold_for
+    }], current_user)
     return {"message": "Property sale registered successfully."}
 
+
+@router.post("/property-sales/bulk", tags=["property_sales"])
+async def register_property_sales_bulk(
+    sales: List[PropertySaleIn],
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Registers a batch of sales with a single set-based INSERT. Each item gets a status:
+    created, already_sold (sold before or earlier in the same batch), not_found or unknown_user.
+    """
+    if not sales:
+        raise HTTPException(status_code=400, detail="No sales provided.")
+    if len(sales) > BULK_MAX_SALES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_SALES} sales per request.")
+    query = """
+        WITH input AS (
+            SELECT *
+            FROM unnest(CAST(:property_ids AS uuid[]), CAST(:userids AS uuid[]),
+                        CAST(:sold_dates AS date[]), CAST(:sold_fors AS numeric[]))
+                 WITH ORDINALITY AS t(property_id, userid, sold_date, sold_for, idx)
+        ),
+        first_claim AS (
+            SELECT DISTINCT ON (i.property_id) i.*
+            FROM input i
+            JOIN properties p ON p.id = i.property_id
+            JOIN users u ON u.userid = i.userid
+            ORDER BY i.property_id, i.idx
+        ),
+        claimed AS (
+            UPDATE properties p SET sold = TRUE
+            FROM first_claim f
+            WHERE p.id = f.property_id AND NOT p.sold
+            RETURNING p.id
+        ),
+        inserted AS (
+            INSERT INTO property_sales (property_id, userid, sold_date, sold_for)
+            SELECT f.property_id, f.userid, f.sold_date, f.sold_for
+            FROM first_claim f
+            JOIN claimed c ON c.id = f.property_id
+            RETURNING id, property_id, userid, sold_date, sold_for
+        ),
+        notified AS (
+            SELECT COUNT(""" + notify_sql("ins", "p", "u") + """) AS n
+            FROM inserted ins
+            JOIN properties p ON p.id = ins.property_id
+            JOIN users u ON u.userid = ins.userid
+        )
+        SELECT i.idx, i.property_id, p.city, ins.id AS sale_id,
+               CASE
+                   WHEN p.id IS NULL THEN 'not_found'
+                   WHEN u.userid IS NULL THEN 'unknown_user'
+                   WHEN ins.id IS NOT NULL AND f.idx = i.idx THEN 'created'
+                   ELSE 'already_sold'
+               END AS status
+        FROM input i
+        CROSS JOIN notified
+        LEFT JOIN properties p ON p.id = i.property_id
+        LEFT JOIN users u ON u.userid = i.userid
+        LEFT JOIN first_claim f ON f.property_id = i.property_id
+        LEFT JOIN inserted ins ON ins.property_id = i.property_id
+        ORDER BY i.idx
+    """
+    rows = await database.fetch_all(query, {
+        "property_ids": [sale.property_id for sale in sales],
+        "userids": [sale.userid for sale in sales],
+        "sold_dates": [sale.sold_date for sale in sales],
+        "sold_fors": [Decimal(str(sale.sold_for)) for sale in sales]
+    })
+    results = [
+        {
+            "index": row["idx"] - 1,
+            "property_id": row["property_id"],
+            "status": row["status"],
+            "sale_id": row["sale_id"] if row["status"] == "created" else None
+        }
+        for row in rows
+    ]
+    created = [
+        {
+            "sale_id": row["sale_id"],
+            "userid": sale.userid,
+            "city": row["city"],
+            "sold_date": sale.sold_date,
+            "sold_for": sale.sold_for
+        }
+        for sale, row in zip(sales, rows) if row["status"] == "created"
+    ]
+    if created:
+        _on_sales_registered(created, current_user)
+    return {
+        "created": len(created),
+        "results": results
+    }
+
 router.include_router(auth_router)
 async def get_users():
     query = "SELECT id, username, role FROM users"
@@ -1,9 +1,17 @@
 from fastapi import APIRouter
-from . import property_sales
+from fastapi.responses import PlainTextResponse
+from metrics import render
+from . import properties, property_sales
 
 router = APIRouter()
 router.include_router(property_sales.router)
+router.include_router(properties.router)
 
 @router.get("/")
 async def read_root():
     return {"message": "Welcome to the Dashe Demo API"}
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,68 @@
+import base64
+import os
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+# db.py builds its pool objects at import time
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+
+from api.property_sales import _decode_cursor, _encode_cursor, _postcode_range
+
+
+def _b64(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sold_date, sale_id", [
+    (date(2024, 2, 29), 1),
+    (date(1999, 12, 31), 2 ** 31 - 1),
+    (date(2025, 1, 1), 0),
+])
+def test_cursor_round_trip(sold_date, sale_id):
+    cursor = _encode_cursor({"sold_date": sold_date, "sale_id": sale_id})
+    assert "=" not in cursor
+    assert _decode_cursor(cursor) == (sold_date, sale_id)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "!!!",
+    "é",
+    _b64("2024-01-01"),
+    _b64("2024-01-01|1|2"),
+    _b64("2024-13-01|1"),
+    _b64("2024-01-01|abc"),
+    _b64("|1"),
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        _decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    ("SW1A", ("SW1A", "SW1B")),
+    (" sw1a ", ("SW1A", "SW1B")),
+    ("E1", ("E1", "E2")),
+    ("M", ("M", "N")),
+    ("AB9", ("AB9", "AB:")),
+    ("N1Z", ("N1Z", "N1[")),
+])
+def test_postcode_range_bounds(prefix, expected):
+    assert _postcode_range(prefix) == expected
+
+
+@pytest.mark.parametrize("prefix, inside, outside", [
+    ("SW1A", ["SW1A", "SW1A 1AA", "SW1AZZZ"], ["SW1", "SW1B", "SW1B 0AA", "SW19 1AA", "SW2"]),
+    ("E1", ["E1", "E1 6AN", "E14 5AB", "E1W 1AA"], ["E", "E2 7DG", "E0", "EC1A 1BB"]),
+    ("AB9", ["AB9", "AB99 1ZZ"], ["AB8 9ZZ", "AB:", "AB10 1AA"]),
+])
+def test_postcode_range_matches_exactly_the_prefix(prefix, inside, outside):
+    # Bytewise ("C" collation) comparison of the uppercased postcode, as in the query
+    low, high = _postcode_range(prefix)
+    for postcode in inside:
+        assert low <= postcode.upper() < high, postcode
+    for postcode in outside:
+        assert not low <= postcode.upper() < high, postcode
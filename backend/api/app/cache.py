@@ -0,0 +1,179 @@
+"""
+Response cache for the read endpoints.
+
+Cached entries are the serialized response body plus its strong ETag, keyed on
+a namespace, the caller's scope and the normalized query. Write paths call
+invalidate() for the namespaces they affect, which also bumps the namespace's
+generation so that results of queries that started before the write are not
+stored afterwards, and records when it happened so that results read from a
+replica that may not have replayed the write yet can be left uncached. The default backend is an in-process LRU; set
+RESPONSE_CACHE_BACKEND to "module:Class" to plug in a shared one implementing
+the same get/set/invalidate methods, or to "none" to disable.
+"""
+import asyncio
+import hashlib
+import importlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND") or "memory"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE") or "512")
+# Total body bytes held per worker, and the largest body worth caching at all
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES") or str(64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES") or str(4 * 1024 * 1024))
+# Upper bound on staleness for writes made through other workers
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL") or "30")
+
+
+class CacheBackend:
+    """Interface for response cache backends. Values are opaque to the backend."""
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value):
+        pass
+
+    def invalidate(self, namespace: str):
+        pass
+
+
+def _value_bytes(value) -> int:
+    # Entries are (body, etag, ...) tuples; the bytes in them dominate their size
+    items = value if isinstance(value, tuple) else (value,)
+    return sum(len(item) for item in items if isinstance(item, (bytes, bytearray)))
+
+
+class MemoryCache(CacheBackend):
+    """
+    LRU with a per-entry TTL, local to this worker, bounded both by entry count
+    and by total body bytes. Bodies over max_entry_bytes are not cached.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES, max_entry_bytes: int = RESPONSE_CACHE_MAX_ENTRY_BYTES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        size = _value_bytes(value)
+        self._remove(key)
+        if size > self.max_entry_bytes:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.total_bytes += size
+        while len(self._entries) > self.maxsize or self.total_bytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted
+
+    def invalidate(self, namespace: str):
+        prefix = namespace + ":"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations: callers with the same key while
+    one is in flight share its result instead of each querying the database.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: str, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # A caller that disconnects must not cancel the query for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+def _load_backend(spec: str) -> CacheBackend:
+    if spec == "memory":
+        return MemoryCache()
+    if spec == "none":
+        return CacheBackend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+response_cache = _load_backend(RESPONSE_CACHE_BACKEND)
+in_flight = SingleFlight()
+
+# Bumped by every invalidate(); a result is only cached if its namespace's
+# generation did not move while it was being computed
+_generations = {}
+_invalidated_at = {}
+
+
+def generation(namespace: str) -> int:
+    return _generations.get(namespace, 0)
+
+
+def invalidate(namespace: str):
+    _generations[namespace] = generation(namespace) + 1
+    _invalidated_at[namespace] = time.monotonic()
+    response_cache.invalidate(namespace)
+
+
+def settled(namespace: str, seconds: float) -> bool:
+    """Whether the namespace has gone at least `seconds` without an invalidation."""
+    invalidated_at = _invalidated_at.get(namespace)
+    return invalidated_at is None or time.monotonic() - invalidated_at >= seconds
+
+
+def cache_key(namespace: str, *parts) -> str:
+    return namespace + ":" + "|".join("" if p is None else str(p) for p in parts)
+
+
+def user_scope(current_user: dict) -> str:
+    """Admins all see the same data, so they share entries; users are cached per userid."""
+    if current_user.get("role") == "admin":
+        return "admin"
+    return "user/" + str(current_user.get("userid"))
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def cached_response(request: Request, body: bytes, etag: str, media_type: str = "application/json", headers: dict = None) -> Response:
+    """
+    Returns 304 when the client already holds this ETag, otherwise the body.
+    no-cache makes browsers revalidate on every visit instead of reusing silently.
+    """
+    headers = dict(headers or {})
+    headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -1,7 +1,165 @@
+import logging
 import os
+import random
+import time
 from databases import Database
 from sqlalchemy import MetaData
 
+from metrics import DB_LATENCY, DB_QUERIES, DB_QUERY_ERRORS, DB_ROWS
+
+# Queries slower than SLOW_QUERY_MS are logged, for a SLOW_QUERY_SAMPLE_RATE fraction of them
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or "500")
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE") or "1.0")
+
+logger = logging.getLogger("db")
+
+
+class InstrumentedDatabase(Database):
+    """
+    databases.Database that times every query, counts returned rows and
+    logs sampled slow queries (without their parameters).
+    """
+
+    def __init__(self, url, name: str = "primary", **options):
+        super().__init__(url, **options)
+        self.name = name
+
+    def _record(self, operation: str, query, started: float, rows: int = 0, failed: bool = False):
+        elapsed = time.perf_counter() - started
+        DB_QUERIES.inc(database=self.name, operation=operation)
+        DB_LATENCY.observe(elapsed, database=self.name, operation=operation)
+        if rows:
+            DB_ROWS.inc(rows, database=self.name, operation=operation)
+        if failed:
+            DB_QUERY_ERRORS.inc(database=self.name, operation=operation)
+        if elapsed * 1000 >= SLOW_QUERY_MS and random.random() < SLOW_QUERY_SAMPLE_RATE:
+            text = " ".join(str(query).split())
+            logger.warning("slow query (%s, %.0f ms, %d rows): %s", operation, elapsed * 1000, rows, text[:1000])
+
+    async def fetch_all(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            rows = await super().fetch_all(query, values)
+        except Exception:
+            self._record("fetch_all", query, started, failed=True)
+            raise
+        self._record("fetch_all", query, started, len(rows))
+        return rows
+
+    async def fetch_one(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            row = await super().fetch_one(query, values)
+        except Exception:
+            self._record("fetch_one", query, started, failed=True)
+            raise
+        self._record("fetch_one", query, started, 0 if row is None else 1)
+        return row
+
+    async def fetch_val(self, query, values=None, column=0):
+        started = time.perf_counter()
+        try:
+            value = await super().fetch_val(query, values, column=column)
+        except Exception:
+            self._record("fetch_val", query, started, failed=True)
+            raise
+        self._record("fetch_val", query, started, 0 if value is None else 1)
+        return value
+
+    async def execute(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            result = await super().execute(query, values)
+        except Exception:
+            self._record("execute", query, started, failed=True)
+            raise
+        self._record("execute", query, started)
+        return result
+
+    async def execute_many(self, query, values):
+        started = time.perf_counter()
+        try:
+            result = await super().execute_many(query, values)
+        except Exception:
+            self._record("execute_many", query, started, failed=True)
+            raise
+        self._record("execute_many", query, started)
+        return result
+
+    async def iterate(self, query, values=None):
+        started = time.perf_counter()
+        rows = 0
+        try:
+            async for row in super().iterate(query, values):
+                rows += 1
+                yield row
+        except Exception:
+            self._record("iterate", query, started, rows, failed=True)
+            raise
+        self._record("iterate", query, started, rows)
+
+    async def copy_from_query(self, query: str, args, output, **options):
+        """
+        Runs COPY (query) TO STDOUT on a pooled connection, passing each chunk to
+        the async output callable. The query uses asyncpg's $n placeholders.
+        """
+        started = time.perf_counter()
+        try:
+            async with self.connection() as connection:
+                result = await connection.raw_connection.copy_from_query(query, *args, output=output, **options)
+        except Exception:
+            self._record("copy", query, started, failed=True)
+            raise
+        self._record("copy", query, started, int(result.split()[-1]) if result else 0)
+        return result
+
+
+def _pool_options(prefix: str) -> dict:
+    """asyncpg pool sizing and statement timeout from <prefix>_POOL_MIN/_POOL_MAX/_STATEMENT_TIMEOUT_MS."""
+    options = {}
+    if os.getenv(f"{prefix}_POOL_MIN"):
+        options["min_size"] = int(os.getenv(f"{prefix}_POOL_MIN"))
+    if os.getenv(f"{prefix}_POOL_MAX"):
+        options["max_size"] = int(os.getenv(f"{prefix}_POOL_MAX"))
+    if os.getenv(f"{prefix}_STATEMENT_TIMEOUT_MS"):
+        options["server_settings"] = {"statement_timeout": os.getenv(f"{prefix}_STATEMENT_TIMEOUT_MS")}
+    return options
+
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-database = Database(DATABASE_URL)
+database = InstrumentedDatabase(DATABASE_URL, **_pool_options("DB"))
+
+# Optional replica for read-only endpoints; without it reads use the primary
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+read_database = (
+    InstrumentedDatabase(DATABASE_READ_URL, name="read", **_pool_options("DB_READ"))
+    if DATABASE_READ_URL else database
+)
+
+# How long a user's reads stay on the primary after they write, covering replica lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS") or "5")
+_recent_writers = {}
+
+
+def note_write(userid):
+    """Routes the user's reads to the primary for the next READ_YOUR_WRITES_SECONDS."""
+    if read_database is database:
+        return
+    now = time.monotonic()
+    if len(_recent_writers) > 10000:
+        for key in [k for k, until in _recent_writers.items() if until <= now]:
+            del _recent_writers[key]
+    _recent_writers[str(userid)] = now + READ_YOUR_WRITES_SECONDS
+
+
+def reader(userid=None):
+    """Database to read from: the replica, unless the user has just written."""
+    if read_database is database:
+        return database
+    until = _recent_writers.get(str(userid)) if userid else None
+    if until is not None and until > time.monotonic():
+        return database
+    return read_database
+
+
 metadata = MetaData()
@@ -0,0 +1,146 @@
+"""
+Streaming bulk exports.
+
+CSV comes straight from Postgres with COPY (query) TO STDOUT: the copy runs in
+its own task and hands chunks to the response through a bounded queue, so a
+slow client pauses the copy instead of buffering it. Parquet is built from a
+server-side cursor one row group at a time, with the encoding done in the
+threadpool. Either way memory stays flat however many rows are exported.
+pyarrow is optional; without it Parquet exports answer 406.
+"""
+import asyncio
+import io
+import os
+import re
+import zlib
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from formats import arrow_values
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+CSV_MEDIA_TYPE = "text/csv"
+GZIP_MEDIA_TYPE = "application/gzip"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES") or str(256 * 1024))
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS") or "8")
+EXPORT_ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS") or "50000")
+
+_NAMED_PARAM = re.compile(r"(?<!:):(\w+)")
+
+
+def positional(query: str, params: dict):
+    """Rewrites :name placeholders to asyncpg's $n, returning the query and its args."""
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _NAMED_PARAM.sub(replace, query), [params[name] for name in names]
+
+
+async def stream_csv(db, query: str, params: dict, compress: bool = False):
+    """Yields the query's rows as CSV with a header line, gzipped if compress is set."""
+    sql, args = positional(query, params)
+    queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    buffer = bytearray()
+
+    async def output(chunk):
+        # COPY hands over small pieces; pass them on in EXPORT_CHUNK_BYTES chunks
+        buffer.extend(chunk)
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            await queue.put(bytes(buffer))
+            buffer.clear()
+
+    async def copy():
+        try:
+            await db.copy_from_query(sql, args, output, format="csv", header=True)
+            if buffer:
+                await queue.put(bytes(buffer))
+        finally:
+            await queue.put(None)
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    task = asyncio.ensure_future(copy())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if compressor:
+                chunk = await run_in_threadpool(compressor.compress, chunk)
+            if chunk:
+                yield chunk
+        # Raises if the copy failed part way
+        await task
+        if compressor:
+            yield compressor.flush()
+    finally:
+        task.cancel()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the Parquet writer emits until drained."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(fields):
+    """Builds the Parquet schema from (name, arrow type alias) pairs; 406 without pyarrow."""
+    if pyarrow is None:
+        raise HTTPException(status_code=406, detail="Parquet output is not available on this server.")
+    return pyarrow.schema([(name, pyarrow.type_for_alias(alias)) for name, alias in fields])
+
+
+async def stream_parquet(db, query: str, params: dict, schema):
+    """Yields a Parquet file of the query's rows, one row group per EXPORT_ROW_GROUP_ROWS."""
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode="w"), schema)
+
+    def write_group(rows):
+        columns = {name: arrow_values([row[name] for row in rows]) for name in schema.names}
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        return sink.drain()
+
+    try:
+        rows = []
+        async for row in db.iterate(query, params):
+            rows.append(row)
+            if len(rows) >= EXPORT_ROW_GROUP_ROWS:
+                yield await run_in_threadpool(write_group, rows)
+                rows = []
+        if rows:
+            yield await run_in_threadpool(write_group, rows)
+        await run_in_threadpool(writer.close)
+        yield sink.drain()
+    finally:
+        if writer.is_open:
+            writer.close()
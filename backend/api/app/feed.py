@@ -0,0 +1,170 @@
+"""
+Live feed of newly committed sales.
+
+The sale write paths call pg_notify on the property_sales channel in the same
+statement as the insert, so notifications go out only when the sale commits.
+Every worker keeps one dedicated LISTEN connection. Notifications that arrive
+together (a bulk upload sends one per sale) are collected into a batch and
+fanned out once to in-process handlers (cache invalidation, sketches) and to
+the bounded queues of its SSE subscribers, so a large upload costs each
+worker a handful of dispatches rather than one per sale. A subscriber that
+falls FEED_QUEUE_SIZE batches behind is dropped with a resync marker instead
+of buffering without limit.
+Notifications sent while the listener is reconnecting are lost, so after a
+reconnect every subscriber gets the marker and the resync handlers rebuild
+whatever the handlers derive from the feed.
+"""
+import asyncio
+import json
+import os
+
+import asyncpg
+
+from metrics import FEED_RESYNCS, FEED_SUBSCRIBERS
+
+CHANNEL = "property_sales"
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE") or "1000")
+
+# Queued to a subscriber that missed events; it should reload its range
+RESYNC = object()
+
+
+class Subscription:
+    def __init__(self, accept, maxsize: int = FEED_QUEUE_SIZE):
+        self.accept = accept
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, sales: list):
+        if self.overflowed:
+            return
+        accepted = [sale for sale in sales if self.accept(sale)]
+        if not accepted:
+            return
+        try:
+            self.queue.put_nowait(accepted)
+        except asyncio.QueueFull:
+            self.resync()
+
+    def resync(self):
+        if self.overflowed:
+            return
+        self.overflowed = True
+        FEED_RESYNCS.inc()
+        # Make room for the marker; the client has to resync anyway
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(RESYNC)
+
+
+class SalesFeed:
+    def __init__(self):
+        self.handlers = []
+        self.resync_handlers = []
+        self.subscribers = set()
+        self._dsn = None
+        self._conn = None
+        self._reconnect = None
+        self._closing = False
+        self._batch = []
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    def add_handler(self, handler, resync=None):
+        """handler(sales) runs per batch of notifications; resync() after notifications may have been missed."""
+        self.handlers.append(handler)
+        if resync is not None:
+            self.resync_handlers.append(resync)
+
+    def subscribe(self, accept) -> Subscription:
+        subscription = Subscription(accept)
+        self.subscribers.add(subscription)
+        FEED_SUBSCRIBERS.set(len(self.subscribers))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+        FEED_SUBSCRIBERS.set(len(self.subscribers))
+
+    async def start(self, dsn: str):
+        self._dsn = dsn.replace("+asyncpg", "")
+        self._closing = False
+        try:
+            await self._connect()
+        except Exception as e:
+            # The API works without the feed; keep retrying in the background
+            print(f"Sales feed listener failed to connect: {e}")
+            self._on_terminated(None)
+
+    async def stop(self):
+        self._closing = True
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self.connected:
+            await self._conn.close()
+        self._conn = None
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self._dsn)
+        conn.add_termination_listener(self._on_terminated)
+        await conn.add_listener(CHANNEL, self._on_notify)
+        self._conn = conn
+
+    def _on_terminated(self, conn):
+        if not self._closing and (self._reconnect is None or self._reconnect.done()):
+            self._reconnect = asyncio.ensure_future(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 0.5
+        while not self._closing:
+            try:
+                await self._connect()
+                print("Sales feed listener reconnected.")
+                self._resync()
+                return
+            except Exception as e:
+                print(f"Sales feed reconnect failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _resync(self):
+        for resync in self.resync_handlers:
+            try:
+                resync()
+            except Exception as e:
+                print(f"Sales feed resync handler failed: {e}")
+        for subscription in list(self.subscribers):
+            subscription.resync()
+
+    def _on_notify(self, conn, pid, channel, payload):
+        sale = json.loads(payload)
+        if not self._batch:
+            # Runs after the notifications already waiting on the loop
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        self._batch.append(sale)
+
+    def _dispatch(self):
+        sales, self._batch = self._batch, []
+        for handler in self.handlers:
+            try:
+                handler(sales)
+            except Exception as e:
+                print(f"Sales feed handler failed: {e}")
+        for subscription in list(self.subscribers):
+            subscription.offer(sales)
+
+
+sales_feed = SalesFeed()
+
+
+def notify_sql(sale_alias: str, property_alias: str, user_alias: str) -> str:
+    """pg_notify call publishing one sale row; the aliases name the joined rows."""
+    s, p, u = sale_alias, property_alias, user_alias
+    return f"""pg_notify('{CHANNEL}', CAST(json_build_object(
+        'sale_id', {s}.id, 'property_id', {s}.property_id, 'userid', {s}.userid,
+        'username', {u}.username, 'address1', {p}.address1, 'city', {p}.city,
+        'latitude', {p}.latitude, 'longitude', {p}.longitude,
+        'sold_for', CAST({s}.sold_for AS DOUBLE PRECISION), 'sold_date', {s}.sold_date
+    ) AS text))"""
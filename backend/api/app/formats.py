@@ -0,0 +1,75 @@
+"""
+Response formats for row-heavy endpoints.
+
+Besides the default list of JSON objects, clients can ask for a columnar
+(struct-of-arrays) JSON body or an Arrow IPC stream, either with ?format= or
+with the Accept header. orjson and pyarrow are optional: without orjson the
+stdlib encoder is used, without pyarrow the Arrow format answers 406.
+"""
+import io
+import json
+from uuid import UUID
+
+from fastapi import HTTPException, Request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.dashe.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+FORMATS = ("json", "columnar", "arrow")
+
+
+def dumps(obj) -> bytes:
+    """Encodes to JSON bytes; dates, UUIDs and Decimals are written as strings."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, separators=(",", ":")).encode()
+
+
+def negotiate_format(request: Request, format: str = None) -> str:
+    if format:
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(FORMATS)}.")
+        return format
+    accept = request.headers.get("accept", "")
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    if ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    return "json"
+
+
+def to_columns(rows, names):
+    return {name: [row[name] for row in rows] for name in names}
+
+
+def columnar_body(columns: dict, count: int) -> bytes:
+    return dumps({"count": count, "columns": columns})
+
+
+def arrow_values(values: list) -> list:
+    """Column values as Arrow takes them, for the Arrow and Parquet outputs."""
+    # Arrow has no UUID type; ship them as strings like the JSON formats do
+    if values and isinstance(values[0], UUID):
+        return [str(v) for v in values]
+    return values
+
+
+def arrow_body(columns: dict) -> bytes:
+    if pyarrow is None:
+        raise HTTPException(status_code=406, detail="Arrow output is not available on this server.")
+    arrays = {name: pyarrow.array(arrow_values(values)) for name, values in columns.items()}
+    table = pyarrow.table(arrays)
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
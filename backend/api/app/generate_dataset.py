@@ -0,0 +1,212 @@
+"""
+Synthetic dataset generator for load testing.
+
+Generates users, properties inside UK_CITY_BOUNDS and sales at a chosen scale,
+deterministically for a given --seed and --end-date, and streams them into
+Postgres with COPY. Properties, which of them are sold and their sales are
+generated with NumPy one chunk at a time, so memory stays bounded from 1k up
+to tens of millions of sales. Run from the app directory:
+
+    python generate_dataset.py --sales 1M --seed 42 --end-date 2024-12-31 --reset
+
+Generated users are named load_user<N> / load_admin<N> and share --password.
+Requires numpy (not needed by the API itself).
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import date
+from decimal import Decimal
+
+import asyncpg
+
+from db import database
+from migrations import migrate
+from partitions import ensure_partitions
+from passwords import hash_password
+from seed import UK_CITY_BOUNDS
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+CITY_POSTCODE_AREAS = {
+    "London": "SW", "Birmingham": "B", "Manchester": "M", "Liverpool": "L", "Leeds": "LS",
+    "Sheffield": "S", "Bristol": "BS", "Newcastle": "NE", "Glasgow": "G", "Edinburgh": "EH",
+    "Cardiff": "CF", "Belfast": "BT", "Nottingham": "NG", "Leicester": "LE", "Southampton": "SO",
+    "Portsmouth": "PO", "Coventry": "CV", "Bradford": "BD", "Stoke-on-Trent": "ST", "Derby": "DE",
+    "Plymouth": "PL", "Wolverhampton": "WV", "Hull": "HU", "Swansea": "SA", "Aberdeen": "AB",
+    "Dundee": "DD", "Cambridge": "CB", "Oxford": "OX", "Reading": "RG", "Milton Keynes": "MK",
+}
+STREET_NAMES = [
+    "High Street", "Station Road", "Church Lane", "Victoria Road", "Green Lane", "Manor Road",
+    "Park Avenue", "Queens Road", "Kings Road", "Mill Lane", "New Road", "London Road",
+    "School Lane", "The Crescent", "Grange Road", "Albert Road", "York Road", "Springfield Road",
+]
+POSTCODE_UNIT_LETTERS = "ABDEFGHJLNPQRSTUWXYZ"
+
+CHUNK_SIZE = 50_000
+
+
+def parse_scale(value: str) -> int:
+    """Parses counts such as 5000, 10k or 2.5M."""
+    value = value.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def _uuids(namespace: int, indexes):
+    # Ids are derived from the row index, so sales can reference properties
+    # and users without keeping millions of UUIDs in memory.
+    return [uuid.UUID(int=namespace | int(i)) for i in indexes]
+
+
+def generate_users(rng, namespace: int, n_users: int, n_admins: int, password_hash: str):
+    ids = _uuids(namespace, range(n_users + n_admins))
+    records = []
+    for i, userid in enumerate(ids):
+        if i < n_users:
+            records.append((userid, f"load_user{i + 1}", password_hash, "user"))
+        else:
+            records.append((userid, f"load_admin{i - n_users + 1}", password_hash, "admin"))
+    return records
+
+
+def generate_properties(rng, namespace: int, start: int, count: int, sold_mask):
+    """Properties start..start+count; sold_mask holds the chunk's sold flags."""
+    cities = list(UK_CITY_BOUNDS)
+    bounds = np.array([UK_CITY_BOUNDS[c] for c in cities])
+    city_idx = rng.integers(0, len(cities), size=count)
+    lat = bounds[city_idx, 0] + rng.random(count) * (bounds[city_idx, 1] - bounds[city_idx, 0])
+    lon = bounds[city_idx, 2] + rng.random(count) * (bounds[city_idx, 3] - bounds[city_idx, 2])
+    house = rng.integers(1, 300, size=count)
+    street = rng.integers(0, len(STREET_NAMES), size=count)
+    district = rng.integers(1, 30, size=count)
+    sector = rng.integers(0, 10, size=count)
+    unit = rng.integers(0, len(POSTCODE_UNIT_LETTERS), size=(count, 2))
+    ids = _uuids(namespace, range(start, start + count))
+    records = []
+    for j in range(count):
+        city = cities[city_idx[j]]
+        postcode = (
+            f"{CITY_POSTCODE_AREAS[city]}{district[j]} {sector[j]}"
+            f"{POSTCODE_UNIT_LETTERS[unit[j, 0]]}{POSTCODE_UNIT_LETTERS[unit[j, 1]]}"
+        )
+        records.append((ids[j], f"{house[j]} {STREET_NAMES[street[j]]}", "", city, postcode, float(lat[j]), float(lon[j]), bool(sold_mask[j])))
+    return records
+
+
+def generate_sales(rng, property_namespace: int, user_namespace: int, property_idx, n_all_users: int, first_day: date, n_days: int):
+    count = len(property_idx)
+    user_idx = rng.integers(0, n_all_users, size=count)
+    # Log-normal prices centred around 300k, clipped to a plausible range, in pence
+    pence = np.clip(rng.lognormal(mean=np.log(300_000), sigma=0.5, size=count), 50_000, 5_000_000)
+    pence = np.round(pence * 100).astype(np.int64)
+    day_offsets = rng.integers(0, n_days, size=count)
+    ordinal = first_day.toordinal()
+    property_ids = _uuids(property_namespace, property_idx)
+    user_ids = _uuids(user_namespace, user_idx)
+    return [
+        (user_ids[j], property_ids[j], Decimal(int(pence[j])).scaleb(-2), date.fromordinal(ordinal + int(day_offsets[j])))
+        for j in range(count)
+    ]
+
+
+async def generate(conn, args):
+    rng = np.random.default_rng(args.seed)
+    user_namespace = int(rng.integers(1, 2 ** 62)) << 64
+    property_namespace = int(rng.integers(1, 2 ** 62)) << 64
+
+    n_sales = args.sales
+    n_properties = args.properties or n_sales * 2
+    if n_properties < n_sales:
+        raise SystemExit("--properties must be at least --sales: each property can only be sold once.")
+    n_users = args.users or max(7, n_sales // 1000)
+    n_admins = max(1, n_users // 10)
+    first_day = first_sale_day(args)
+    n_days = (args.end_date - first_day).days + 1
+
+    started = time.perf_counter()
+    password_hash = await hash_password(args.password)
+    users = generate_users(rng, user_namespace, n_users, n_admins, password_hash)
+    await conn.copy_records_to_table("users", records=users, columns=["userid", "username", "password", "role"])
+    print(f"users: {len(users)}")
+
+    sales_left = n_sales
+    for start in range(0, n_properties, args.chunk_size):
+        count = min(args.chunk_size, n_properties - start)
+        # Draw how many of the remaining sales land in this chunk, then which
+        # properties, so exactly n_sales are sold without permuting every property
+        n_sold = int(rng.hypergeometric(sales_left, n_properties - start - sales_left, count)) if sales_left else 0
+        sales_left -= n_sold
+        sold = rng.choice(count, size=n_sold, replace=False)
+        sold_mask = np.zeros(count, dtype=bool)
+        sold_mask[sold] = True
+        records = generate_properties(rng, property_namespace, start, count, sold_mask)
+        await conn.copy_records_to_table(
+            "properties", records=records,
+            columns=["id", "address1", "address2", "city", "postcode", "latitude", "longitude", "sold"]
+        )
+        if n_sold:
+            records = generate_sales(
+                rng, property_namespace, user_namespace, start + sold, n_users + n_admins, first_day, n_days
+            )
+            await conn.copy_records_to_table(
+                "property_sales", records=records,
+                columns=["userid", "property_id", "sold_for", "sold_date"]
+            )
+    print(f"properties: {n_properties}")
+    print(f"property_sales: {n_sales} from {first_day} to {args.end_date}")
+
+    await conn.execute("ANALYZE users; ANALYZE properties; ANALYZE property_sales;")
+    print(f"Generated dataset in {time.perf_counter() - started:.1f}s")
+
+
+def first_sale_day(args) -> date:
+    # Sales cover --years calendar years ending at --end-date
+    return date(args.end_date.year - args.years + 1, 1, 1)
+
+
+async def main(args):
+    await database.connect()
+    try:
+        await migrate(database)
+        await ensure_partitions(database, first_sale_day(args))
+    finally:
+        await database.disconnect()
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL").replace("+asyncpg", ""))
+    try:
+        if args.reset:
+            await conn.execute("TRUNCATE property_sales, properties, users")
+        elif await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users)"):
+            raise SystemExit("Database already has users; use --reset to replace them.")
+        await generate(conn, args)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for load testing.")
+    parser.add_argument("--sales", type=parse_scale, default=parse_scale("10k"), help="Number of sales, e.g. 1k, 250k, 10M")
+    parser.add_argument("--properties", type=parse_scale, default=None, help="Number of properties (default: 2x sales)")
+    parser.add_argument("--users", type=parse_scale, default=None, help="Number of non-admin users (default: sales/1000, at least 7)")
+    parser.add_argument("--years", type=int, default=5, help="Spread sales over this many calendar years up to --end-date")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="Date of the latest possible sale, YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed; with the same --end-date gives the same dataset")
+    parser.add_argument("--password", default=os.getenv("LOADTEST_PASSWORD") or "loadtest", help="Password for every generated user")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows generated and copied per batch")
+    parser.add_argument("--reset", action="store_true", help="Delete existing data first")
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("generate_dataset.py requires numpy: pip install numpy")
+    asyncio.run(main(args))
@@ -0,0 +1,77 @@
+"""
+Great-circle helpers for radius and nearest-neighbour queries over properties.
+
+Searches first narrow on a latitude/longitude bounding box, which the btree
+index on properties (latitude, longitude) serves, and only then compute the
+haversine distance in SQL for the remaining candidates.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+# Nearest-neighbour searches without a radius start small and double up to the maximum
+INITIAL_RADIUS_KM = 1.0
+MAX_RADIUS_KM = 50.0
+
+
+def distance_sql(alias: str = "p") -> str:
+    """Haversine distance in km from (:lat, :lon) to the aliased properties row."""
+    return (
+        f"(2 * {EARTH_RADIUS_KM} * asin(LEAST(1.0, sqrt("
+        f"power(sin(radians({alias}.latitude - :lat) / 2), 2) + "
+        f"cos(radians(:lat)) * cos(radians({alias}.latitude)) * "
+        f"power(sin(radians({alias}.longitude - :lon) / 2), 2)))))"
+    )
+
+
+def bbox_sql(alias: str = "p") -> str:
+    return (
+        f"{alias}.latitude BETWEEN :min_lat AND :max_lat "
+        f"AND {alias}.longitude BETWEEN :min_lon AND :max_lon"
+    )
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> dict:
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # Longitude degrees shrink towards the poles; clamp to avoid dividing by ~0
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.01)))
+    return {
+        "min_lat": lat - dlat,
+        "max_lat": lat + dlat,
+        "min_lon": lon - dlon,
+        "max_lon": lon + dlon,
+    }
+
+
+def search_radii(radius_km: float = None):
+    """The radius for a radius search, or the expanding radii for a nearest search."""
+    if radius_km:
+        return [radius_km]
+    radii = []
+    radius = INITIAL_RADIUS_KM
+    while radius < MAX_RADIUS_KM:
+        radii.append(radius)
+        radius *= 2
+    radii.append(MAX_RADIUS_KM)
+    return radii
+
+
+async def nearby(database, select_sql: str, filters: list, params: dict, lat: float, lon: float, radius_km: float, limit: int):
+    """
+    Runs `select_sql` (which must select `distance_sql() AS distance_km` FROM
+    properties p ...) for increasing radii until `limit` rows are found, and
+    returns the rows ordered by distance.
+    """
+    rows = []
+    for radius in search_radii(radius_km):
+        query_params = dict(params, lat=lat, lon=lon, radius=radius, limit=limit, **bounding_box(lat, lon, radius))
+        where = " AND ".join(filters + [bbox_sql()])
+        query = f"""
+            SELECT * FROM ({select_sql} WHERE {where}) AS candidates
+            WHERE distance_km <= :radius
+            ORDER BY distance_km
+            LIMIT :limit
+        """
+        rows = await database.fetch_all(query, query_params)
+        if len(rows) >= limit:
+            break
+    return rows
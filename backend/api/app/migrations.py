@@ -0,0 +1,169 @@
+"""
+Versioned, forward-only schema migrations.
+
+Each migration is a list of SQL statements (or async callables taking the
+database) applied once, in order, and recorded in schema_migrations.
+Concurrent workers serialize on a Postgres advisory lock, so starting several
+at once is safe. Run `python migrations.py` to apply pending migrations by hand.
+"""
+import asyncio
+
+from partitions import DEFAULT_PARTITION, ensure_partitions
+
+# Arbitrary application-wide key for pg_advisory_xact_lock
+MIGRATION_LOCK_KEY = 715_224_001
+
+MIGRATIONS = [
+    (1, "create users, properties and property_sales", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            userid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            username VARCHAR(255) UNIQUE NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            role VARCHAR(50) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS properties (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            address1 VARCHAR(255) NOT NULL,
+            address2 VARCHAR(255),
+            city VARCHAR(100) NOT NULL,
+            postcode VARCHAR(20) NOT NULL,
+            latitude DOUBLE PRECISION NOT NULL,
+            longitude DOUBLE PRECISION NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS property_sales (
+            id SERIAL PRIMARY KEY,
+            userid UUID NOT NULL,
+            property_id UUID NOT NULL,
+            sold_for NUMERIC(12, 2) NOT NULL,
+            sold_date DATE NOT NULL,
+            CONSTRAINT fk_user FOREIGN KEY(userid) REFERENCES users(userid) ON DELETE CASCADE,
+            CONSTRAINT fk_property FOREIGN KEY(property_id) REFERENCES properties(id) ON DELETE CASCADE,
+            CONSTRAINT unique_user_property UNIQUE (userid, property_id)
+        )
+        """,
+    ]),
+    (2, "index property_sales by user, date and property", [
+        "CREATE INDEX IF NOT EXISTS idx_property_sales_userid_sold_date ON property_sales (userid, sold_date)",
+        "CREATE INDEX IF NOT EXISTS idx_property_sales_sold_date ON property_sales (sold_date, id)",
+        "CREATE INDEX IF NOT EXISTS idx_property_sales_property_id ON property_sales (property_id)",
+    ]),
+    (3, "maintained sold flag on properties with partial unsold indexes", [
+        "ALTER TABLE properties ADD COLUMN IF NOT EXISTS sold BOOLEAN NOT NULL DEFAULT FALSE",
+        "UPDATE properties p SET sold = TRUE WHERE EXISTS (SELECT 1 FROM property_sales ps WHERE ps.property_id = p.id)",
+        "CREATE INDEX IF NOT EXISTS idx_properties_unsold ON properties (id) INCLUDE (address1, address2, city) WHERE NOT sold",
+        "CREATE INDEX IF NOT EXISTS idx_properties_unsold_city ON properties (city, id) INCLUDE (address1, address2) WHERE NOT sold",
+        """CREATE INDEX IF NOT EXISTS idx_properties_unsold_postcode ON properties ((upper(postcode) COLLATE "C"), id) WHERE NOT sold""",
+    ]),
+    (4, "range-partition property_sales by sold_date", [
+        "ALTER TABLE property_sales RENAME TO property_sales_unpartitioned",
+        "ALTER SEQUENCE property_sales_id_seq OWNED BY NONE",
+        # A unique index on a partitioned table must include sold_date, so
+        # "sold once" is enforced by the properties.sold claim from here on.
+        """
+        CREATE TABLE property_sales (
+            id INTEGER NOT NULL DEFAULT nextval('property_sales_id_seq'),
+            userid UUID NOT NULL,
+            property_id UUID NOT NULL,
+            sold_for NUMERIC(12, 2) NOT NULL,
+            sold_date DATE NOT NULL,
+            PRIMARY KEY (id, sold_date),
+            CONSTRAINT fk_user FOREIGN KEY(userid) REFERENCES users(userid) ON DELETE CASCADE,
+            CONSTRAINT fk_property FOREIGN KEY(property_id) REFERENCES properties(id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (sold_date)
+        """,
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF property_sales DEFAULT",
+        # Create the periods covering the existing history before copying it in
+        lambda database: _partition_existing_sales(database),
+        "INSERT INTO property_sales SELECT id, userid, property_id, sold_for, sold_date FROM property_sales_unpartitioned",
+        "DROP TABLE property_sales_unpartitioned",
+        "ALTER SEQUENCE property_sales_id_seq OWNED BY property_sales.id",
+        "CREATE INDEX idx_property_sales_userid_sold_date ON property_sales (userid, sold_date)",
+        "CREATE INDEX idx_property_sales_sold_date ON property_sales (sold_date, id)",
+        "CREATE INDEX idx_property_sales_property_id ON property_sales (property_id)",
+    ]),
+    (5, "index property locations for radius searches", [
+        "CREATE INDEX IF NOT EXISTS idx_properties_lat_lon ON properties (latitude, longitude)",
+    ]),
+    (6, "full-text search vector over property addresses", [
+        # 'simple' keeps postcodes and house numbers as typed, without stemming
+        """
+        ALTER TABLE properties ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', address1), 'A') ||
+            setweight(to_tsvector('simple', postcode), 'A') ||
+            setweight(to_tsvector('simple', coalesce(address2, '')), 'B') ||
+            setweight(to_tsvector('simple', city), 'C')
+        ) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_properties_search ON properties USING GIN (search_vector)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _partition_existing_sales(database):
+    first_day = await database.fetch_val("SELECT MIN(sold_date) FROM property_sales_unpartitioned")
+    await ensure_partitions(database, first_day)
+
+
+async def current_version(database) -> int:
+    exists = await database.fetch_val("SELECT to_regclass('public.schema_migrations') IS NOT NULL")
+    if not exists:
+        return 0
+    return await database.fetch_val("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+
+async def migrate(database) -> int:
+    """
+    Applies pending migrations and returns the resulting schema version.
+    When the schema is already current this costs a single round-trip or two.
+    """
+    if await current_version(database) >= LATEST_VERSION:
+        return LATEST_VERSION
+    async with database.transaction():
+        await database.execute(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_KEY})")
+        await database.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        # Another worker may have migrated while we waited for the lock
+        version = await current_version(database)
+        for migration_version, name, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            print(f"Applying migration {migration_version}: {name}")
+            for statement in statements:
+                if callable(statement):
+                    await statement(database)
+                else:
+                    await database.execute(statement)
+            await database.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (:version, :name)",
+                {"version": migration_version, "name": name}
+            )
+            version = migration_version
+    return version
+
+
+async def main():
+    from db import database
+    await database.connect()
+    try:
+        version = await migrate(database)
+        print(f"Schema is at version {version}.")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    asyncio.run(main())
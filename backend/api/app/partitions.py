@@ -0,0 +1,114 @@
+"""
+Range partitions of property_sales on sold_date.
+
+Partitions span PROPERTY_SALES_PARTITION_MONTHS months (12 = yearly) aligned
+to calendar boundaries, with a default partition catching anything outside
+them. ensure_partitions() creates any missing partitions from a given date up
+to PROPERTY_SALES_PARTITIONS_AHEAD periods past today, moving matching rows
+out of the default partition so the new partition can be attached.
+"""
+import os
+import re
+from datetime import date
+
+PARTITION_MONTHS = int(os.getenv("PROPERTY_SALES_PARTITION_MONTHS") or "12")
+PARTITIONS_AHEAD = int(os.getenv("PROPERTY_SALES_PARTITIONS_AHEAD") or "2")
+DEFAULT_PARTITION = "property_sales_default"
+
+# Arbitrary application-wide key so only one worker creates partitions at a time
+PARTITION_LOCK_KEY = 715_224_002
+
+_BOUND_PATTERN = re.compile(r"FROM \('([0-9-]+)'\) TO \('([0-9-]+)'\)")
+
+
+def _month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+
+def _from_month_index(index: int) -> date:
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_start(day: date) -> date:
+    index = _month_index(day)
+    return _from_month_index(index - index % PARTITION_MONTHS)
+
+
+def partition_name(start: date) -> str:
+    if PARTITION_MONTHS == 12 and start.month == 1:
+        return f"property_sales_{start.year}"
+    return f"property_sales_{start.year}_{start.month:02d}"
+
+
+def partition_periods(first_day: date, last_day: date):
+    """Yields (start, end) for every period covering first_day..last_day; end is exclusive."""
+    index = _month_index(partition_start(first_day))
+    last = _month_index(last_day)
+    while index <= last:
+        yield _from_month_index(index), _from_month_index(index + PARTITION_MONTHS)
+        index += PARTITION_MONTHS
+
+
+async def partition_ranges(database):
+    """Returns the (start, end) bounds of the existing range partitions."""
+    rows = await database.fetch_all("""
+        SELECT pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('property_sales')
+    """)
+    ranges = []
+    for row in rows:
+        match = _BOUND_PATTERN.search(row["bound"] or "")
+        if match:
+            ranges.append((date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return ranges
+
+
+async def create_partition(database, start: date, end: date):
+    """Creates the partition for [start, end) and attaches it, moving rows out of the default partition."""
+    name = partition_name(start)
+    async with database.transaction():
+        await database.execute(f"CREATE TABLE {name} (LIKE property_sales INCLUDING DEFAULTS)")
+        # Rows that landed in the default partition must move before ATTACH accepts the range
+        await database.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE sold_date >= :start AND sold_date < :end
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, {"start": start, "end": end})
+        await database.execute(
+            f"ALTER TABLE property_sales ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    print(f"Created partition {name} for [{start}, {end}).")
+
+
+async def ensure_partitions(database, first_day: date = None) -> int:
+    """
+    Makes sure partitions exist from first_day (default: today) through
+    PARTITIONS_AHEAD periods ahead. Periods overlapping an existing partition
+    (e.g. after PARTITION_MONTHS changed) are skipped and stay in the default
+    partition. Returns the number of partitions created.
+    """
+    today = date.today()
+    last_index = _month_index(partition_start(today)) + PARTITIONS_AHEAD * PARTITION_MONTHS
+    periods = list(partition_periods(first_day or today, _from_month_index(last_index)))
+
+    def missing(ranges):
+        return [
+            (start, end) for start, end in periods
+            if not any(start < r_end and r_start < end for r_start, r_end in ranges)
+        ]
+
+    if not missing(await partition_ranges(database)):
+        return 0
+    async with database.transaction():
+        await database.execute(f"SELECT pg_advisory_xact_lock({PARTITION_LOCK_KEY})")
+        # Re-read under the lock in case another worker just created them
+        todo = missing(await partition_ranges(database))
+        for start, end in todo:
+            await create_partition(database, start, end)
+    return len(todo)
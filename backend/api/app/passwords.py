@@ -0,0 +1,55 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt releases the GIL, so a small thread pool gives real parallelism
+# without blocking the event loop for the full hash cost.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS") or "12")
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS") or str(min(4, os.cpu_count() or 1)))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE") or "64")
+
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+class PasswordQueueFull(Exception):
+    """Raised when more than BCRYPT_MAX_QUEUE hash operations are already waiting."""
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= BCRYPT_MAX_QUEUE:
+        raise PasswordQueueFull()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+async def hash_password(password: str, rounds: int = None) -> str:
+    return await _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run(_check, password, hashed)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """
+    True when the stored hash was made with a cost factor other than BCRYPT_ROUNDS.
+    """
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,203 @@
+"""
+Incrementally maintained price distributions of property_sales.sold_for.
+
+Each (city, month) group keeps a DDSketch, which answers quantiles within
+SKETCH_RELATIVE_ACCURACY and merges exactly, plus fixed-width histogram
+buckets. Both are sparse, so memory grows with the groups and price ranges
+seen rather than with the number of sales. The store is built once from
+property_sales (aggregated in SQL down to one row per sketch bin) and then
+updated on every registered sale, so queries cost O(groups x bins) whatever
+the number of sales. Per-user distributions are not kept here: a user's own
+sales are few and indexed, so they are answered in SQL.
+"""
+import asyncio
+import math
+import os
+
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY") or "0.01")
+PRICE_HISTOGRAM_WIDTH = float(os.getenv("PRICE_HISTOGRAM_WIDTH") or "100000")
+# The last bucket is open-ended
+PRICE_HISTOGRAM_BUCKETS = int(os.getenv("PRICE_HISTOGRAM_BUCKETS") or "20")
+
+_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+def sketch_key(value: float) -> int:
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+def histogram_bucket(value: float) -> int:
+    return min(int(value // PRICE_HISTOGRAM_WIDTH), PRICE_HISTOGRAM_BUCKETS - 1)
+
+
+def histogram_buckets(counts: dict):
+    """Every histogram bucket with its count, from a sparse bucket -> count map."""
+    return [
+        {
+            "from": i * PRICE_HISTOGRAM_WIDTH,
+            "to": (i + 1) * PRICE_HISTOGRAM_WIDTH if i < PRICE_HISTOGRAM_BUCKETS - 1 else None,
+            "count": counts.get(i, 0)
+        }
+        for i in range(PRICE_HISTOGRAM_BUCKETS)
+    ]
+
+
+class PriceStats:
+    """DDSketch over positive prices plus count/sum/min/max and a sparse fixed-width histogram."""
+
+    __slots__ = ("bins", "histogram", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.bins = {}
+        self.histogram = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value <= 0:
+            return
+        key = sketch_key(value)
+        self.bins[key] = self.bins.get(key, 0) + 1
+        bucket = histogram_bucket(value)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def add_bin(self, key: int, bucket: int, count: int, total: float, low: float, high: float):
+        self.bins[key] = self.bins.get(key, 0) + count
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        self.count += count
+        self.total += total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other: "PriceStats"):
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                estimate = 2 * _GAMMA ** key / (_GAMMA + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def histogram_buckets(self):
+        return histogram_buckets(self.histogram)
+
+
+class PriceDistributions:
+    """Per-worker store of PriceStats keyed by (city, month) across all users."""
+
+    def __init__(self):
+        self.overall = {}
+        self._loading = None
+        self._pending = None
+
+    def add(self, sale_id: int, city: str, month, sold_for: float):
+        if self._pending is not None:
+            # Replayed after the build if its snapshot did not include this sale
+            self._pending.append((sale_id, city, month, sold_for))
+        self._stats(self.overall, (city, month)).add(sold_for)
+
+    @staticmethod
+    def _stats(store, key):
+        stats = store.get(key)
+        if stats is None:
+            stats = store[key] = PriceStats()
+        return stats
+
+    async def load(self, database):
+        self._pending = []
+        overall = {}
+        try:
+            async with database.transaction(isolation="repeatable_read"):
+                rows = await database.fetch_all("""
+                    SELECT p.city, CAST(date_trunc('month', ps.sold_date) AS DATE) AS month,
+                           CAST(CEIL(LN(CAST(ps.sold_for AS DOUBLE PRECISION)) / CAST(:log_gamma AS DOUBLE PRECISION)) AS INTEGER) AS k,
+                           LEAST(CAST(FLOOR(CAST(ps.sold_for AS DOUBLE PRECISION) / CAST(:width AS DOUBLE PRECISION)) AS INTEGER),
+                                 CAST(:last_bucket AS INTEGER)) AS bucket,
+                           COUNT(*) AS n, CAST(SUM(ps.sold_for) AS DOUBLE PRECISION) AS total,
+                           CAST(MIN(ps.sold_for) AS DOUBLE PRECISION) AS low,
+                           CAST(MAX(ps.sold_for) AS DOUBLE PRECISION) AS high
+                    FROM property_sales ps
+                    JOIN properties p ON ps.property_id = p.id
+                    WHERE ps.sold_for > 0
+                    GROUP BY 1, 2, 3, 4
+                """, {"log_gamma": _LOG_GAMMA, "width": PRICE_HISTOGRAM_WIDTH, "last_bucket": PRICE_HISTOGRAM_BUCKETS - 1})
+                for row in rows:
+                    self._stats(overall, (row["city"], row["month"])).add_bin(
+                        row["k"], row["bucket"], row["n"], row["total"], row["low"], row["high"]
+                    )
+                # Ids are not assigned in commit order, so ask the snapshot which of the
+                # sales added meanwhile it already holds; repeat for any that arrive
+                # during the check, then swap without yielding to the loop.
+                visible = set()
+                checked = 0
+                while checked < len(self._pending):
+                    ids = [sale[0] for sale in self._pending[checked:]]
+                    checked = len(self._pending)
+                    found = await database.fetch_all("SELECT id FROM property_sales WHERE id = ANY(:ids)", {"ids": ids})
+                    visible.update(row["id"] for row in found)
+                pending, self._pending = self._pending, None
+                self.overall = overall
+                for sale in pending:
+                    if sale[0] not in visible:
+                        self.add(*sale)
+        finally:
+            self._pending = None
+
+    def start_loading(self, database):
+        # A reload requested mid-load runs after it, as loads share the pending list
+        self._loading = asyncio.ensure_future(self._load_after(self._loading, database))
+        return self._loading
+
+    async def _load_after(self, previous, database):
+        if previous is not None and not previous.done():
+            try:
+                await previous
+            except Exception:
+                pass
+        await self.load(database)
+
+    async def ready(self, database):
+        if self._loading is None or (self._loading.done() and self._loading.exception()):
+            self.start_loading(database)
+        await asyncio.shield(self._loading)
+
+    def query(self, cities=None, start_month=None, end_month=None, group_by=()):
+        """
+        Merges the matching groups into one PriceStats per group_by key
+        (a tuple drawn from "city" and "month").
+        """
+        merged = {}
+        for (city, month), stats in self.overall.items():
+            if cities and city not in cities:
+                continue
+            if start_month and month < start_month:
+                continue
+            if end_month and month > end_month:
+                continue
+            parts = {"city": city, "month": month}
+            key = tuple(parts[g] for g in group_by)
+            self._stats(merged, key).merge(stats)
+        return merged
+
+
+price_distributions = PriceDistributions()
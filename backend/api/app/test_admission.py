@@ -0,0 +1,208 @@
+import asyncio
+
+import jwt
+import pytest
+
+import admission
+from admission import AdmissionMiddleware
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    # Small, fast limits; tokens are used verbatim as the userid
+    monkeypatch.setitem(admission.CLASS_CONCURRENCY, "expensive", 2)
+    monkeypatch.setattr(admission, "ADMISSION_USER_CONCURRENCY", 2)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_QUEUE", 32)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_TIMEOUT_MS", 50)
+    monkeypatch.setattr(admission, "ADMISSION_SHED_WAIT_MS", 1000)
+    monkeypatch.setattr(admission, "ADMISSION_RETRY_AFTER", 3)
+    monkeypatch.setattr(admission, "decode_token", lambda token: {"userid": token})
+
+
+class HeldApp:
+    """Stub ASGI app that keeps requests in flight until released."""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.release = None
+
+    async def __call__(self, scope, receive, send):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+        finally:
+            self.running -= 1
+
+
+async def request(middleware, path="/property-sales", method="GET", user="u1"):
+    scope = {"type": "http", "method": method, "path": path, "headers": []}
+    if user is not None:
+        scope["headers"].append((b"authorization", f"Bearer {user}".encode()))
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start.get("headers", []))
+
+
+def run(coro_fn):
+    async def main():
+        app = HeldApp()
+        app.release = asyncio.Event()
+        return await coro_fn(app, AdmissionMiddleware(app))
+    return asyncio.run(main())
+
+
+def test_class_limit_sheds_after_deadline_with_retry_after():
+    async def scenario(app, middleware):
+        held = [asyncio.ensure_future(request(middleware, user=f"u{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        status, headers = await request(middleware, user="u9")
+        app.release.set()
+        return status, headers, [await r for r in held], app.peak, middleware
+
+    status, headers, held, peak, middleware = run(scenario)
+    assert status == 503
+    assert headers[b"retry-after"] == b"3"
+    assert [s for s, _ in held] == [200, 200]
+    assert peak == 2
+    route_class = middleware.classes["expensive"]
+    assert route_class.queued == 0 and not route_class.slots.locked()
+    assert middleware.users == {}
+
+
+def test_queued_request_admitted_when_slot_frees_before_deadline(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_TIMEOUT_MS", 1000)
+
+    async def scenario(app, middleware):
+        held = [asyncio.ensure_future(request(middleware, user=f"u{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert middleware.classes["expensive"].queued == 1
+        app.release.set()
+        return [await r for r in held], app.peak
+
+    results, peak = run(scenario)
+    assert [s for s, _ in results] == [200, 200, 200]
+    assert peak == 2
+
+
+def test_per_user_limit_leaves_room_for_other_users(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_USER_CONCURRENCY", 1)
+
+    async def scenario(app, middleware):
+        first = asyncio.ensure_future(request(middleware, user="admin"))
+        await asyncio.sleep(0.01)
+        second_same_user = await request(middleware, user="admin")
+        other = asyncio.ensure_future(request(middleware, user="agent"))
+        await asyncio.sleep(0.01)
+        app.release.set()
+        return second_same_user[0], (await first)[0], (await other)[0]
+
+    assert run(scenario) == (503, 200, 200)
+
+
+def test_full_queue_sheds_immediately(monkeypatch):
+    monkeypatch.setitem(admission.CLASS_CONCURRENCY, "expensive", 1)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_QUEUE", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_TIMEOUT_MS", 1000)
+
+    async def scenario(app, middleware):
+        held = [asyncio.ensure_future(request(middleware, user=f"u{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        status, _ = await request(middleware, user="u9")
+        elapsed = loop.time() - started
+        app.release.set()
+        return status, elapsed, [(await r)[0] for r in held]
+
+    status, elapsed, held = run(scenario)
+    assert status == 503
+    assert elapsed < 0.5
+    assert held == [200, 200]
+
+
+def test_high_smoothed_wait_sheds_only_while_saturated(monkeypatch):
+    monkeypatch.setitem(admission.CLASS_CONCURRENCY, "expensive", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_TIMEOUT_MS", 1000)
+
+    async def scenario(app, middleware):
+        app.release.set()
+        assert (await request(middleware))[0] == 200
+        route_class = middleware.classes["expensive"]
+        route_class.wait_ms = 5000
+        # Free slot: admitted despite the high average
+        assert (await request(middleware))[0] == 200
+        route_class.wait_ms = 5000
+        app.release.clear()
+        held = asyncio.ensure_future(request(middleware, user="u1"))
+        await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        shed = (await request(middleware, user="u2"))[0]
+        elapsed = loop.time() - started
+        app.release.set()
+        return shed, elapsed, (await held)[0]
+
+    shed, elapsed, held = run(scenario)
+    assert shed == 503
+    assert elapsed < 0.5
+    assert held == 200
+
+
+def test_wait_average_tracks_queueing_delay():
+    route_class = admission.RouteClass("expensive", 1)
+    for _ in range(50):
+        route_class.record_wait(2000)
+    assert route_class.wait_ms == pytest.approx(2000, rel=0.01)
+    for _ in range(50):
+        route_class.record_wait(0)
+    assert route_class.wait_ms < 1
+
+
+def test_unclassified_routes_are_not_limited():
+    async def scenario(app, middleware):
+        held = [asyncio.ensure_future(request(middleware, path="/login", method="POST")) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        peak = app.peak
+        app.release.set()
+        return peak, [(await r)[0] for r in held]
+
+    peak, statuses = run(scenario)
+    assert peak == 10
+    assert statuses == [200] * 10
+
+
+def test_slots_released_when_app_raises():
+    async def failing(scope, receive, send):
+        raise RuntimeError("boom")
+
+    async def main():
+        middleware = AdmissionMiddleware(failing)
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await request(middleware)
+        route_class = middleware.classes["expensive"]
+        return route_class.slots.locked(), route_class.queued, middleware.users
+
+    assert asyncio.run(main()) == (False, 0, {})
+
+
+def test_invalid_token_counts_as_anonymous(monkeypatch):
+    def reject(token):
+        raise jwt.InvalidTokenError("bad")
+
+    monkeypatch.setattr(admission, "decode_token", reject)
+    scope = {"headers": [(b"authorization", b"Bearer nope")]}
+    assert admission._user_key(scope) == "anonymous"
+    assert admission._user_key({"headers": []}) == "anonymous"
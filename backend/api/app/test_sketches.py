@@ -0,0 +1,154 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from datetime import date
+
+from sketches import (
+    PRICE_HISTOGRAM_BUCKETS,
+    PRICE_HISTOGRAM_WIDTH,
+    SKETCH_RELATIVE_ACCURACY,
+    PriceDistributions,
+    PriceStats,
+    histogram_bucket,
+    sketch_key,
+)
+
+MONTH = date(2024, 1, 1)
+
+
+def _prices(n, seed=7):
+    rng = random.Random(seed)
+    return [round(rng.lognormvariate(12.5, 0.6), 2) for _ in range(n)]
+
+
+def _stats(values):
+    stats = PriceStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def test_quantiles_within_relative_accuracy():
+    values = _prices(20000)
+    stats = _stats(values)
+    ordered = sorted(values)
+    for q in (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        estimate = stats.quantile(q)
+        assert abs(estimate - exact) <= SKETCH_RELATIVE_ACCURACY * exact * (1 + 1e-9), q
+
+
+def test_quantiles_clamped_to_observed_range():
+    stats = _stats([250000.0])
+    assert stats.quantile(0) == 250000.0
+    assert stats.quantile(1) == 250000.0
+
+
+def test_empty_and_non_positive():
+    stats = _stats([0, -5])
+    assert stats.count == 0
+    assert stats.quantile(0.5) is None
+
+
+def test_merge_matches_single_sketch():
+    values = _prices(5000)
+    merged = _stats(values[:1234])
+    merged.merge(_stats(values[1234:]))
+    whole = _stats(values)
+    assert merged.bins == whole.bins
+    assert merged.histogram == whole.histogram
+    assert merged.count == whole.count
+    assert merged.min == whole.min and merged.max == whole.max
+    assert abs(merged.total - whole.total) < 1e-6 * whole.total
+    for q in (0.1, 0.5, 0.9):
+        assert merged.quantile(q) == whole.quantile(q)
+
+
+def test_add_bin_matches_add():
+    values = [120000.0, 120500.0, 121000.0, 900000.0]
+    binned = PriceStats()
+    groups = {}
+    for value in values:
+        groups.setdefault((sketch_key(value), histogram_bucket(value)), []).append(value)
+    for (key, bucket), group in groups.items():
+        binned.add_bin(key, bucket, len(group), sum(group), min(group), max(group))
+    direct = _stats(values)
+    assert binned.bins == direct.bins
+    assert binned.histogram == direct.histogram
+    assert (binned.count, binned.min, binned.max) == (direct.count, direct.min, direct.max)
+
+
+def test_histogram_last_bucket_is_open_ended():
+    assert histogram_bucket(PRICE_HISTOGRAM_WIDTH * 1000) == PRICE_HISTOGRAM_BUCKETS - 1
+    buckets = _stats([PRICE_HISTOGRAM_WIDTH * 1000]).histogram_buckets()
+    assert buckets[-1]["to"] is None and buckets[-1]["count"] == 1
+
+
+def test_histogram_is_sparse_but_lists_every_bucket():
+    stats = _stats([PRICE_HISTOGRAM_WIDTH * 2.5, PRICE_HISTOGRAM_WIDTH * 2.7])
+    assert stats.histogram == {2: 2}
+    buckets = stats.histogram_buckets()
+    assert len(buckets) == PRICE_HISTOGRAM_BUCKETS
+    assert [b["count"] for b in buckets[:4]] == [0, 0, 2, 0]
+
+
+def _bin_row(city, value, n=1):
+    return {
+        "city": city, "month": MONTH,
+        "k": sketch_key(value), "bucket": histogram_bucket(value),
+        "n": n, "total": value * n, "low": value, "high": value,
+    }
+
+
+class FakeDatabase:
+    """Snapshot rows plus the sale ids visible to it; hooks simulate concurrent adds."""
+
+    def __init__(self, rows, visible_ids, during_snapshot=None, during_check=None):
+        self.rows = rows
+        self.visible_ids = set(visible_ids)
+        self.during_snapshot = during_snapshot
+        self.during_check = during_check
+        self.checked = []
+
+    @asynccontextmanager
+    async def transaction(self, isolation=None):
+        yield
+
+    async def fetch_all(self, query, values=None):
+        if "ANY(:ids)" in query:
+            self.checked.append(list(values["ids"]))
+            if self.during_check:
+                hook, self.during_check = self.during_check, None
+                hook()
+            return [{"id": i} for i in values["ids"] if i in self.visible_ids]
+        if self.during_snapshot:
+            self.during_snapshot()
+        return self.rows
+
+
+def test_load_replays_only_sales_missing_from_snapshot():
+    store = PriceDistributions()
+
+    def concurrent_sales():
+        # Sale 7 committed before the snapshot, sale 5 (a lower id) after it
+        store.add(7, "Leeds", MONTH, 300000.0)
+        store.add(5, "Leeds", MONTH, 200000.0)
+
+    database = FakeDatabase([_bin_row("Leeds", 300000.0)], visible_ids={7}, during_snapshot=concurrent_sales)
+    asyncio.run(store.load(database))
+    stats = store.query()[()]
+    assert stats.count == 2
+    assert stats.min == 200000.0 and stats.max == 300000.0
+
+
+def test_load_checks_sales_added_during_the_visibility_check():
+    store = PriceDistributions()
+    database = FakeDatabase(
+        [], visible_ids=set(),
+        during_snapshot=lambda: store.add(1, "York", MONTH, 100000.0),
+        during_check=lambda: store.add(2, "York", MONTH, 150000.0),
+    )
+    asyncio.run(store.load(database))
+    assert database.checked == [[1], [2]]
+    assert store.query()[()].count == 2
+    assert store._pending is None
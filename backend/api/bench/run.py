@@ -0,0 +1,297 @@
+"""
+Endpoint load benchmark for the API.
+
+Drives a weighted mix of GET /property-sales, GET /unsold-properties,
+POST /property-sales and POST /login at fixed concurrency levels against a
+running API, optionally regenerating the dataset at each requested size
+first, and reports throughput and p50/p95/p99 latency per endpoint.
+Results are written as JSON; with --baseline the run fails (exit code 1)
+when p95 latency or throughput regress past the limits in --thresholds.
+Regenerated datasets are anchored at --end-date, which is recorded in the
+results and taken from the baseline when not given, so both runs measure
+the same data.
+
+    docker compose up -d db api
+    python bench/run.py --dataset-sizes 10k,100k --concurrency 1,8,32 \
+        --output bench/results.json --baseline bench/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+DEFAULT_THRESHOLDS = os.path.join(BENCH_DIR, "thresholds.json")
+DEFAULT_MIX = "sales=50,unsold=20,register=20,login=10"
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("sales", "unsold", "register", "login"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Session:
+    """A logged-in benchmark user with a shared HTTP session."""
+
+    def __init__(self, http, base_url: str, username: str, password: str):
+        self.http = http
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.token = None
+        self.userid = None
+
+    async def login(self):
+        async with self.http.post(
+            f"{self.base_url}/login",
+            data={"username": self.username, "password": self.password}
+        ) as res:
+            body = await res.json() if res.status == 200 else None
+            if body:
+                self.token = body["access_token"]
+                self.userid = body["userid"]
+            return res.status
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class Benchmark:
+    def __init__(self, args, http, sessions, unsold_ids):
+        self.args = args
+        self.http = http
+        self.sessions = sessions
+        self.unsold_ids = unsold_ids
+        self.rng = random.Random(args.seed)
+        self.latencies = {name: [] for name in args.mix}
+        self.errors = {name: 0 for name in args.mix}
+        # Ranges end at the dataset's anchor date so reruns read the same rows
+        end = date.fromisoformat(args.end_date)
+        self.ranges = [
+            ((end - timedelta(days=90)).isoformat(), end.isoformat()),
+            ((end - timedelta(days=365)).isoformat(), end.isoformat()),
+            ((end - timedelta(days=365 * 5)).isoformat(), end.isoformat()),
+        ]
+
+    async def _request(self, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with self.http.request(method, url, **kwargs) as res:
+                await res.read()
+                ok = res.status < 400
+        except aiohttp.ClientError:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if ok:
+            self.latencies[name].append(elapsed)
+        else:
+            self.errors[name] += 1
+
+    async def sales(self, session):
+        start, end = self.rng.choice(self.ranges)
+        await self._request("sales", "GET", f"{self.args.base_url}/property-sales",
+                            params={"start_date": start, "end_date": end}, headers=session.headers)
+
+    async def unsold(self, session):
+        await self._request("unsold", "GET", f"{self.args.base_url}/unsold-properties",
+                            params={"limit": 100}, headers=session.headers)
+
+    async def register(self, session):
+        if not self.unsold_ids:
+            return await self.sales(session)
+        payload = {
+            "property_id": self.unsold_ids.pop(),
+            "userid": session.userid,
+            "sold_date": self.args.end_date,
+            "sold_for": round(self.rng.uniform(100000, 1000000), 2),
+        }
+        await self._request("register", "POST", f"{self.args.base_url}/property-sales",
+                            json=payload, headers=session.headers)
+
+    async def login(self, session):
+        await self._request("login", "POST", f"{self.args.base_url}/login",
+                            data={"username": session.username, "password": session.password})
+
+    async def worker(self, deadline: float):
+        names = list(self.args.mix)
+        weights = [self.args.mix[n] for n in names]
+        while time.perf_counter() < deadline:
+            session = self.rng.choice(self.sessions)
+            name = self.rng.choices(names, weights)[0]
+            await getattr(self, name)(session)
+
+    async def run(self, concurrency: int) -> dict:
+        if self.args.warmup:
+            warmup_deadline = time.perf_counter() + self.args.warmup
+            await asyncio.gather(*(self.worker(warmup_deadline) for _ in range(concurrency)))
+            self.latencies = {name: [] for name in self.args.mix}
+            self.errors = {name: 0 for name in self.args.mix}
+        started = time.perf_counter()
+        await asyncio.gather(*(self.worker(started + self.args.duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        endpoints = {}
+        for name, values in self.latencies.items():
+            values.sort()
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "throughput": len(values) / elapsed,
+                "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+        return {"concurrency": concurrency, "duration_s": elapsed, "endpoints": endpoints}
+
+
+def prepare_dataset(size: str, args):
+    print(f"Generating dataset with {size} sales...")
+    subprocess.run(
+        [sys.executable, "generate_dataset.py", "--sales", size, "--seed", str(args.seed),
+         "--end-date", args.end_date, "--password", args.password, "--reset"],
+        cwd=APP_DIR, check=True
+    )
+    if args.settle:
+        # Let cached responses from the previous dataset expire
+        time.sleep(args.settle)
+
+
+async def fetch_unsold_ids(http, base_url: str, session: Session, count: int):
+    async with http.get(f"{base_url}/unsold-properties", params={"limit": count}, headers=session.headers) as res:
+        res.raise_for_status()
+        return [item["property_id"] for item in await res.json()]
+
+
+async def run_dataset(args, dataset: str) -> list:
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency) * 2)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        sessions = [Session(http, args.base_url, name, args.password) for name in args.users]
+        statuses = await asyncio.gather(*(s.login() for s in sessions))
+        sessions = [s for s, status in zip(sessions, statuses) if status == 200]
+        if not sessions:
+            raise SystemExit("No benchmark user could log in; check --users and --password.")
+        runs = []
+        for concurrency in args.concurrency:
+            unsold_ids = await fetch_unsold_ids(http, args.base_url, sessions[0], 5000)
+            random.Random(args.seed).shuffle(unsold_ids)
+            print(f"[{dataset}] concurrency {concurrency}...")
+            result = await Benchmark(args, http, sessions, unsold_ids).run(concurrency)
+            result["dataset"] = dataset
+            for name, stats in result["endpoints"].items():
+                print(f"  {name:9} {stats['throughput']:8.1f} req/s  p50 {stats['p50_ms']:7.1f} ms  "
+                      f"p95 {stats['p95_ms']:7.1f} ms  p99 {stats['p99_ms']:7.1f} ms  errors {stats['errors']}")
+            runs.append(result)
+        return runs
+
+
+def compare(results: dict, baseline: dict, thresholds: dict) -> list:
+    """Returns a description of every regression past the thresholds."""
+    def key(run):
+        return run["dataset"], run["concurrency"]
+
+    baseline_runs = {key(run): run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        base = baseline_runs.get(key(run))
+        if not base:
+            continue
+        for name, stats in run["endpoints"].items():
+            before = base["endpoints"].get(name)
+            if not before or not before["requests"]:
+                continue
+            label = f"{run['dataset']} c={run['concurrency']} {name}"
+            limit = before["p95_ms"] * (1 + thresholds["p95_increase"])
+            if stats["p95_ms"] > limit:
+                regressions.append(f"{label}: p95 {stats['p95_ms']:.1f} ms > {limit:.1f} ms")
+            floor = before["throughput"] * (1 - thresholds["throughput_decrease"])
+            if stats["throughput"] < floor:
+                regressions.append(f"{label}: throughput {stats['throughput']:.1f} req/s < {floor:.1f} req/s")
+            error_rate = stats["errors"] / max(1, stats["requests"] + stats["errors"])
+            if error_rate > thresholds["max_error_rate"]:
+                regressions.append(f"{label}: error rate {error_rate:.1%} > {thresholds['max_error_rate']:.1%}")
+    return regressions
+
+
+async def main(args):
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.end_date is None:
+        args.end_date = (baseline or {}).get("end_date") or date.today().isoformat()
+    runs = []
+    for dataset in args.dataset_sizes or ["existing"]:
+        if dataset != "existing":
+            prepare_dataset(dataset, args)
+        runs.extend(await run_dataset(args, dataset))
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "base_url": args.base_url,
+        "mix": args.mix,
+        "duration_s": args.duration,
+        "seed": args.seed,
+        "end_date": args.end_date,
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if baseline is not None:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+        regressions = compare(results, baseline, thresholds)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API endpoints.")
+    parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL") or "http://localhost:8000")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 8, 32],
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds measured per concurrency level")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each level")
+    parser.add_argument("--dataset-sizes", type=lambda v: v.split(","), default=None,
+                        help="Regenerate the dataset at each size (e.g. 10k,1M) via app/generate_dataset.py; "
+                             "default: use the data already loaded")
+    parser.add_argument("--settle", type=float, default=30, help="Seconds to wait after regenerating a dataset")
+    parser.add_argument("--users", type=lambda v: v.split(","),
+                        default=[f"load_user{i}" for i in range(1, 8)] + ["load_admin1"],
+                        help="Comma-separated usernames to log in as")
+    parser.add_argument("--password", default=os.getenv("LOADTEST_PASSWORD") or "loadtest")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end-date", default=None,
+                        help="Anchor date of regenerated datasets, YYYY-MM-DD (default: the baseline's, else today)")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON and fail on regressions")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="Regression limits JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -6,24 +6,32 @@ import { useSession } from '../context/SessionContext';
 export default function SaleEntryScreen() {
   const { accessToken, userId } = useSession();
   const [property, setProperty] = useState('');
+  const [propertySearch, setPropertySearch] = useState('');
   const [propertyOptions, setPropertyOptions] = useState([
-    { label: 'Select a property...', value: '' }
+    { label: 'Search for a property...', value: '' }
   ]);
-  const [loadingProperties, setLoadingProperties] = useState(true);
+  const [loadingProperties, setLoadingProperties] = useState(false);
 
   useEffect(() => {
-    const fetchProperties = async () => {
+    const q = propertySearch.trim();
+    if (q.length < 2) {
+      setPropertyOptions([{ label: 'Search for a property...', value: '' }]);
+      return;
+    }
+    // Debounced so typing does not send a request per keystroke
+    const timer = setTimeout(async () => {
       setLoadingProperties(true);
       try {
         const apiBaseUrl = process.env.EXPO_PUBLIC_API_BASE_URL;
-        const res = await fetch(`${apiBaseUrl}/unsold-properties`, {
+        const params = new URLSearchParams({ q, sold: 'false', limit: '20' });
+        const res = await fetch(`${apiBaseUrl}/properties/search?${params}`, {
           headers: accessToken ? { 'Authorization': `Bearer ${accessToken}` } : {},
         });
-        const data = await res.json();
-        // Expecting data to be an array of { id, name } or similar
+        // The server rejects queries without a word of two or more characters
+        const data = res.ok ? await res.json() : [];
         const options = [
-          { label: 'Select a property...', value: '' },
-          ...data.map((item: any) => ({ label: item.address1, value: item.property_id }))
+          { label: data.length ? 'Select a property...' : 'No matching properties', value: '' },
+          ...data.map((item: any) => ({ label: `${item.address1}, ${item.postcode}`, value: item.property_id }))
         ];
         setPropertyOptions(options);
       } catch (e) {
@@ -31,9 +39,9 @@ export default function SaleEntryScreen() {
       } finally {
         setLoadingProperties(false);
       }
-    };
-    fetchProperties();
-  }, [accessToken]);
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [propertySearch, accessToken]);
   const [date, setDate] = useState('');
   const [amount, setAmount] = useState('');
   const [submitted, setSubmitted] = useState(false);
@@ -73,6 +81,13 @@ export default function SaleEntryScreen() {
   return (
     <View style={styles.container}>
       <Text style={styles.title}>Sale Entry</Text>
+      <TextInput
+        style={styles.input}
+        placeholder="Search address or postcode"
+        value={propertySearch}
+        onChangeText={setPropertySearch}
+        autoCorrect={false}
+      />
       <View style={styles.pickerContainer}>
         {loadingProperties ? (
           <ActivityIndicator size="small" color="#007AFF" style={{ marginVertical: 12 }} />
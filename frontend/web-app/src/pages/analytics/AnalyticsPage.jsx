@@ -25,27 +25,17 @@ export default function AnalyticsPage() {
 
   useEffect(() => {
     const { start, end } = getQuarterDates();
-    fetch(`${import.meta.env.VITE_API_BASE_URL}/property-sales?start_date=${start}&end_date=${end}`, {
-      headers: session.access_token ? { 'Authorization': `Bearer ${session.access_token}` } : {}
-    })
-      .then(res => {
-        if (!res.ok) throw new Error('Failed to fetch property sales');
-        return res.json();
-      })
-      .then(data => {
-        // Aggregate by city
-        const cityCounts = {};
-        const userCounts = {};
-        data.forEach(item => {
-          if (item.city) {
-            cityCounts[item.city] = (cityCounts[item.city] || 0) + 1;
-          }
-          if (item.username) {
-            userCounts[item.username] = (userCounts[item.username] || 0) + 1;
-          }
+    const headers = session.access_token ? { 'Authorization': `Bearer ${session.access_token}` } : {};
+    const fetchAggregates = (groupBy) =>
+      fetch(`${import.meta.env.VITE_API_BASE_URL}/property-sales/aggregates?group_by=${groupBy}&start_date=${start}&end_date=${end}`, { headers })
+        .then(res => {
+          if (!res.ok) throw new Error('Failed to fetch property sales');
+          return res.json();
         });
-        setCityData(Object.entries(cityCounts).sort((a,b)=>b[1]-a[1]).slice(0,10));
-        setUserData(Object.entries(userCounts).sort((a,b)=>b[1]-a[1]).slice(0,10));
+    Promise.all([fetchAggregates('city'), fetchAggregates('user')])
+      .then(([byCity, byUser]) => {
+        setCityData(byCity.map(item => [item.city, item.count]).sort((a,b)=>b[1]-a[1]).slice(0,10));
+        setUserData(byUser.map(item => [item.username, item.count]).sort((a,b)=>b[1]-a[1]).slice(0,10));
         setError(null);
       })
       .catch(e => setError(e.message))